@@ -0,0 +1,46 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(statement: str) -> tuple[float, list[tuple[int, str]]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    total, modules = 0, []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match is None:
+            continue
+        modules.append((int(match.group(1)), match.group(4)))
+        if len(match.group(3)) == 1:
+            total += int(match.group(2))
+    return total / 1_000_000, sorted(modules, reverse=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("statement", nargs="?", default="import models")
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    parser.add_argument("-t", "--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [measure(args.statement) for _ in range(args.repeat)]
+    totals = [total for total, _ in runs]
+    print(f"{args.statement}: median {statistics.median(totals):.3f}s (min {min(totals):.3f}s, n={args.repeat})")
+    for self_time, module in runs[totals.index(min(totals))][1][:args.top]:
+        print(f"  {self_time / 1000:8.1f}ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
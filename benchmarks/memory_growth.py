@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from typing import Any
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from models import Society
+from models.action import Dialogue, EvaluatedAction
+from utils.llm.base import LLM
+from utils.memory import MemoryProfiler
+
+
+class EchoLLM(LLM):
+    def __init__(self, agents: list[str], areas: list[str], seed: int) -> None:
+        super().__init__()
+        self._agents = agents
+        self._areas = areas
+        self._rng = random.Random(seed)
+
+    def _action(self) -> dict[str, Any]:
+        kind = self._rng.choice(["talk", "eat", "sleep", "move", "other", "other"])
+        return {
+            "talk": {"type": "talk", "target": [self._rng.choice(self._agents)], "content": "こんにちは"},
+            "eat": {"type": "eat", "food": "パン"},
+            "sleep": {"type": "sleep"},
+            "move": {"type": "move", "destination": self._rng.choice(self._areas)},
+            "other": {"type": "other", "detail": f"本を{self._rng.randint(1, 50)}ページ読む"},
+        }[kind]
+
+    def generate(self, *, model=None, prompt=None, messages, schema=None, **kwargs) -> Any:
+        if schema is EvaluatedAction:
+            return EvaluatedAction(
+                action="{actor}は本を読んだ。", actor="actor", target=None, duration="PT1H", allow=True, thinking=[]
+            )
+        if schema is Dialogue:
+            return None
+        if self._site == "agent.act":
+            return json.dumps({"thinking": "考え", "action": self._action()}, ensure_ascii=False)
+        return "いつも通り。"
+
+    async def async_generate(self, *, model=None, prompt=None, messages, schema=None, **kwargs) -> Any:
+        await asyncio.sleep(0)
+        return self.generate(model=model, prompt=prompt, messages=messages, schema=schema, **kwargs)
+
+
+async def run(args: argparse.Namespace) -> MemoryProfiler:
+    society = Society(seed=args.seed)
+    llm = EchoLLM(
+        [agent.id for _, agent in society.agent_list],
+        list(society.location.areas.keys()),
+        args.seed
+    )
+    profiler = MemoryProfiler(
+        every=args.every,
+        warmup=args.warmup,
+        max_bytes_per_tick=args.max_bytes_per_tick,
+        filepath=args.output
+    ).attach(society.hooks)
+    try:
+        for _ in range(args.ticks):
+            await society.step_all(llm)
+    finally:
+        profiler.detach(society.hooks)
+    return profiler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--ticks", type=int, default=300)
+    parser.add_argument("-e", "--every", type=int, default=20)
+    parser.add_argument("-w", "--warmup", type=int, default=1)
+    parser.add_argument("-m", "--max-bytes-per-tick", type=float, default=None)
+    parser.add_argument("-o", "--output", default=None)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.output is not None and os.path.exists(args.output):
+        os.remove(args.output)
+    profiler = asyncio.run(run(args))
+    print(profiler.summary())
+    print(f"bytes/tick after warm-up: {profiler.bytes_per_tick:.0f}")
+    try:
+        profiler.check()
+    except RuntimeError as e:
+        print(f"FAIL: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
 from .agent import Agent, AgentList
 from .area import Area, Location
 from .society import Society
+from .world import District, WorldSummary
+from .shard import LocalTransport, ShardedSociety, Transport
@@ -5,12 +5,15 @@ import random
 import re
 from typing import Any, Literal, override
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from .agent import Agent
+from .log import ACTOR, TARGET, LogStore
 from utils import time as timeutils
 from utils.llm.base import LLM
+from utils.budget import Budgeter, Section
 from utils.functions import cleaned
+from utils.similarity import SimilarityIndex
 
 
 class Action(BaseModel, ABC):
@@ -22,6 +25,7 @@ class Action(BaseModel, ABC):
     fatigue: int = 1
     effort: int = 1
     raw_action: Any
+    _log_index: int | None = PrivateAttr(default=None)
 
     @abstractmethod
     def _log_text(self, actor: str, target: str) -> str:
@@ -32,6 +36,14 @@ class Action(BaseModel, ABC):
         target = "あなた" if agent in self.target else "、".join(map(lambda x: x.name_with_id, self.target))
 
         return f"■{self.time}\n{self._log_text(actor, target)}"
+
+    def log_template(self) -> str:
+        return f"■{self.time}\n{self._log_text(ACTOR, TARGET)}"
+
+    def intern(self, store: LogStore) -> int:
+        if self._log_index is None:
+            self._log_index = store.append(self)
+        return self._log_index
     
 
 class Dead(Action):
@@ -106,6 +118,73 @@ class Talk(Action):
         return f"{actor}は{target}に話しかけた。\n「{self.content}」"
 
 
+class DialogueLine(BaseModel):
+    speaker: str
+    content: str
+
+
+class Dialogue(BaseModel):
+    lines: list[DialogueLine]
+
+    @classmethod
+    async def generate(cls, opener: Talk, area_info: str, turns: int, llm: LLM) -> Dialogue:
+        participants = [opener.speaker, *opener.target]
+        prompt = cleaned(
+            """
+            あなたはとある街で暮らす人々の会話を描写する脚本家です。
+            {speaker}の発言から始まった会話の続きを、参加者の人物像に沿って生成してください。
+            ### 方針
+            - 発言は最大{turns}回までとし、会話が自然に終わる場合はそれより短くてよい。
+            - 各発言の`speaker`には発言者のエージェント ID を記述する。
+            - 参加者以外のエージェントを発言させない。
+            - `content`はセリフのみを記述する。
+            """,
+            speaker=opener.speaker.name_with_id,
+            turns=turns
+        )
+        people = "\n".join(
+            f"- {agent.name_with_id} [{agent.job}] 性格: {agent.character}、コミュニケーション能力: {agent.sociability}"
+            for agent in participants
+        )
+        message = cleaned(
+            """
+            ## 参加者
+            {people}
+            ## 周囲の状況
+            {area_info}
+            ## 会話の始まり
+            {opener}
+            """,
+            people=people,
+            area_info=area_info,
+            opener=opener.log(None)
+        )
+        dialogue = await llm.site("dialogue").async_generate(
+            prompt=prompt,
+            messages=message,
+            schema=cls
+        )
+        return cls(lines=[]) if dialogue is None else dialogue
+
+    def talks(self, opener: Talk, clock: timeutils.Clock, turns: int) -> list[Talk]:
+        participants = {agent.id: agent for agent in [opener.speaker, *opener.target]}
+        talks = []
+        for line in self.lines:
+            speaker = participants.get(line.speaker)
+            if speaker is None or not line.content:
+                continue
+            talks.append(Talk(
+                speaker,
+                [agent for agent in participants.values() if agent != speaker],
+                clock.at(len(talks) + 1),
+                line.content,
+                {"type": "talk", "content": line.content, "dialogue": True}
+            ))
+            if len(talks) >= turns:
+                break
+        return talks
+
+
 class Eat(Action):
     food: str | list[str]
 
@@ -131,12 +210,19 @@ class Sleep(Action):
     faint: bool
 
     @override
-    def __init__(self, actor: Agent, time: str, faint: bool=False, raw_action: Any=None) -> None:
+    def __init__(
+            self, 
+            actor: Agent, 
+            time: str, 
+            faint: bool=False, 
+            raw_action: Any=None, 
+            rng: random.Random | None=None
+    ) -> None:
         super().__init__(
             target=[],
             actor=actor,
             time=time,
-            duration=random.randint(timeutils.calc(hour=5), timeutils.calc(hour=8)), 
+            duration=(rng or random).randint(timeutils.calc(hour=5), timeutils.calc(hour=8)), 
             status="睡眠中",
             faint=faint,
             raw_action=raw_action
@@ -171,7 +257,8 @@ class Move(Action):
             duration=duration, 
             status="移動中",
             destination=destination,
-            means=means
+            means=means,
+            raw_action=raw_action
         )
     
     @override
@@ -191,6 +278,41 @@ class EvaluatedAction(BaseModel):
     thinking: list[str]
 
 
+class EvaluationCache(BaseModel):
+    threshold: float = 0.8
+    hits: int = 0
+    misses: int = 0
+    _indexes: dict[str, SimilarityIndex[EvaluatedAction]] = PrivateAttr(default_factory=dict)
+    _pending: list[tuple[str, str, EvaluatedAction]] = PrivateAttr(default_factory=list)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _index(self, area: str) -> SimilarityIndex[EvaluatedAction]:
+        if area not in self._indexes:
+            self._indexes[area] = SimilarityIndex[EvaluatedAction](threshold=self.threshold)
+        return self._indexes[area]
+
+    def get(self, detail: str, area: str) -> EvaluatedAction | None:
+        result = self._index(area).query(detail)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result[1]
+
+    def put(self, detail: str, area: str, action: EvaluatedAction) -> None:
+        self._pending.append((detail, area, action))
+
+    def commit(self) -> None:
+        # puts become visible only here, so lookups within a tick see the same snapshot whatever the completion order
+        pending, self._pending = self._pending, []
+        for detail, area, action in sorted(pending, key=lambda x: (x[1], x[0])):
+            self._index(area).add(detail, action)
+
+
 class OtherAction(Action):
     action: str
 
@@ -223,7 +345,20 @@ class OtherAction(Action):
         return self.action.format(**param)
     
     @classmethod
-    async def evaluate(cls, raw_action: str, agent: Agent, area_info: str, llm: LLM) -> EvaluatedAction:
+    async def evaluate(
+            cls, 
+            raw_action: dict[str, Any], 
+            agent: Agent, 
+            area_info: str, 
+            llm: LLM,
+            cache: EvaluationCache | None = None,
+            budgeter: Budgeter | None = None
+    ) -> EvaluatedAction:
+        detail = raw_action.get("detail") if isinstance(raw_action, dict) else None
+        if cache is not None and isinstance(detail, str):
+            if (cached := cache.get(detail, area_info)) is not None:
+                return cached
+
         prompt = cleaned(
             """
             あなたはAIエージェントを用いた社会シミュレーション実験の監督システムです。
@@ -242,6 +377,17 @@ class OtherAction(Action):
               - **倫理的でない行動**とは区別する。他人の物を盗んだり、他人の命を奪っても社会シミュレーションは継続可能である。
             """, actor="{actor}", target="{target}"
         )
+        action = json.dumps(raw_action, ensure_ascii=False)
+        agent_info, area_text = agent.info, area_info
+        if budgeter is not None:
+            # the action is what gets judged, so it counts towards the limit but is never cut
+            texts = budgeter.fit(
+                "action.evaluate",
+                Section(name="agent", text=agent_info, priority=1),
+                Section(name="area", text=area_info, priority=0),
+                Section(name="action", text=action, priority=2, minimum=budgeter.estimate(action))
+            )
+            agent_info, area_text = texts["agent"], texts["area"]
         message = cleaned(
             """
             ## エージェント情報
@@ -251,13 +397,15 @@ class OtherAction(Action):
             ## エージェントの行動
             {action}
             """,
-            agent_info=agent.info,
-            area_info=area_info,
-            action=json.dumps(raw_action)
+            agent_info=agent_info,
+            area_info=area_text,
+            action=action
         )
-        action = await llm.async_generate(
+        action = await llm.site("action.evaluate").async_generate(
             prompt=prompt,
             messages=message,
             schema=EvaluatedAction
         )
+        if cache is not None and isinstance(detail, str) and isinstance(action, EvaluatedAction):
+            cache.put(detail, area_info, action)
         return action
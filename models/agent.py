@@ -1,21 +1,27 @@
 from __future__ import annotations
-from collections.abc import Iterator
+from collections.abc import Iterable, Iterator
 import random
 import re
 import textwrap
 from typing import Any, Literal, TYPE_CHECKING
 
-import pandas as pd
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, PrivateAttr
 
 from utils import time
 from utils.llm.base import LLM
+from utils.budget import Budgeter, Section
 from utils.functions import cleaned, collection_search, parse_json
+from utils.loader import cached, iter_json_records
+
+from .log import LogEntry, LogStore, LogView
 
 if TYPE_CHECKING:
     from .action import Action
 
 
+_PROFILE_KEYS = ("名前", "職業", "特徴語", "行動力", "コミュニケーション能力")
+
+
 class Agent(BaseModel):
     id: str
     name: str
@@ -30,7 +36,7 @@ class Agent(BaseModel):
     status: Literal["行動可能", "行動中", "睡眠中", "移動中", "死亡"] = "行動可能"
     action_timer: int = 0
     thinking: str = ""
-    action_log: list[str] = Field(default_factory=list)
+    _log: LogView | None = PrivateAttr(default=None)
 
     @property
     def name_with_id(self) -> str:
@@ -41,7 +47,19 @@ class Agent(BaseModel):
         return f"[{self.job}] {self.name_with_id}: {self.status}"
 
     @property
-    def persona(self) -> str:
+    def urgency(self) -> float:
+        return max(self.hungry / time.calc(day=1), self.sleepiness / time.calc(hour=20))
+
+    @property
+    def action_log(self) -> list[str]:
+        return [] if self._log is None else self._log.render()
+
+    @property
+    def log_store(self) -> LogStore | None:
+        return None if self._log is None else self._log.store
+
+    @property
+    def profile(self) -> str:
         data = []
 
         data.append(cleaned(
@@ -59,7 +77,7 @@ class Agent(BaseModel):
         data.append(f"### 眠気: {int(100 * self.sleepiness / time.calc(hour=20))}/100")
         if self.sleepiness < time.calc(hour=1):
             data.append("睡眠から目覚めた。")
-        elif self.sleepiness < time.calc(10):
+        elif self.sleepiness < time.calc(hour=10):
             data.append("眠気は感じない。")
         elif self.sleepiness < time.calc(hour=15):
             data.append("疲労がたまり、眠くなってきた。")
@@ -81,23 +99,41 @@ class Agent(BaseModel):
         if self.thinking:
             data.append(f"\n### 直前の行動の思考\n{self.thinking}")
 
-        data.append(f"\n### 行動ログ")
-        if len(self.action_log) == 0:
-            data.append("情報なし")
-        else:
-            data.extend(self.action_log)
-
         return "\n".join(data)
+
+    @property
+    def persona(self) -> str:
+        return self._persona(self.profile, "\n".join(self.action_log))
+
+    @staticmethod
+    def _persona(profile: str, log: str) -> str:
+        return f"{profile}\n\n### 行動ログ\n{log or '情報なし'}"
     
     def recent_action(self, n: int=5) -> list[str]:
-        return self.action_log[-(min(n, len(self.action_log))):]
+        return [] if self._log is None else self._log.render(-min(n, len(self._log)))
     
-    async def act(self, llm: LLM, area_info: str, global_info: str) -> dict[str, Any]:
+    async def act(
+            self, 
+            llm: LLM, 
+            area_info: str, 
+            global_info: str, 
+            budgeter: Budgeter | None = None
+    ) -> dict[str, Any]:
+        self.thinking, action = await self.deliberate(llm, area_info, global_info, budgeter)
+        return action
+
+    async def deliberate(
+            self, 
+            llm: LLM, 
+            area_info: str, 
+            global_info: str, 
+            budgeter: Budgeter | None = None
+    ) -> tuple[str, dict[str, Any]]:
         if self.hungry >= time.calc(day=3):
-            return {"type": "dead"}
+            return self.thinking, {"type": "dead"}
         
         if self.sleepiness >= time.calc(day=1):
-            return {"type": "sleep", "faint": True}
+            return self.thinking, {"type": "sleep", "faint": True}
 
         schema = textwrap.dedent(
             """
@@ -136,6 +172,18 @@ class Agent(BaseModel):
             """,
             schema
         )
+        if budgeter is None:
+            persona = self.persona
+        else:
+            texts = budgeter.fit(
+                "agent.act",
+                Section(name="global", text=global_info, priority=1),
+                Section(name="area", text=area_info, priority=2),
+                Section(name="profile", text=self.profile, priority=3),
+                Section(name="log", text="\n".join(self.action_log), priority=0, keep="tail")
+            )
+            global_info, area_info = texts["global"], texts["area"]
+            persona = self._persona(texts["profile"], texts["log"])
         message = cleaned(
             """
             ## グローバル情報
@@ -145,20 +193,33 @@ class Agent(BaseModel):
             ## あなたの情報
             {}
             """, 
-            global_info, area_info, self.persona
+            global_info, area_info, persona
         )
         
-        raw_behavior = await llm.async_generate(
+        raw_behavior = await llm.site("agent.act").async_generate(
             prompt=prompt,
             messages=message,
+            until_json=True
         )
 
         behavior = parse_json(raw_behavior)
-        self.thinking = behavior["thinking"]
-        return behavior["action"]
+        return behavior["thinking"], behavior["action"]
     
-    def append_action_log(self, *log: str) -> None:
-        self.action_log.extend(log)
+    def attach(self, store: LogStore, entries: Iterable[LogEntry] = ()) -> None:
+        self._log = LogView(store, self.id, (store.add(entry) for entry in entries))
+
+    def detach(self) -> list[LogEntry]:
+        entries = [] if self._log is None else self._log.entries()
+        self._log = None
+        return entries
+
+    def append_action_log(self, *index: int) -> None:
+        self._log.append(*index)
+
+    def fork(self, store: LogStore) -> Agent:
+        agent = self.model_copy()
+        agent._log = None if self._log is None else self._log.fork(store)
+        return agent
 
     def __hash__(self) -> int:
         return hash(self.id)
@@ -176,37 +237,62 @@ class AgentList(BaseModel):
     def view(self) -> dict[str, list[str]]:
         return self.agents
 
+    @staticmethod
+    def _profiles(filepath: str) -> Iterator[tuple[str, ...]]:
+        for row in iter_json_records(filepath):
+            yield tuple(row[key] for key in _PROFILE_KEYS)
+
     @classmethod
-    def from_json_file(cls, filepath: str, areas: list[str]) -> AgentList:
-        df = pd.read_json(filepath)
-        return cls(agents={
-            (id := f"agent_{str(i).zfill(3)}"): Agent(
+    def from_json_file(
+            cls, 
+            filepath: str, 
+            areas: list[str], 
+            cache_dir: str | None = None, 
+            rng: random.Random | None = None
+    ) -> AgentList:
+        if cache_dir is None:
+            profiles = cls._profiles(filepath)
+        else:
+            profiles = cached(filepath, "agents", lambda: list(cls._profiles(filepath)), cache_dir)
+
+        agents, hungry, rng = {}, time.calc(hour=7), rng or random
+        for i, (name, job, character, initiative, sociability) in enumerate(profiles):
+            id = f"agent_{str(i).zfill(3)}"
+            agents[id] = Agent(
                 id=id,
-                name=row.loc["名前"],
-                job=row.loc["職業"],
-                character=row.loc["特徴語"],
-                initiative=row.loc["行動力"],
-                sociability=row.loc["コミュニケーション能力"],
-                area=random.choice(areas),
-                hungry=time.calc(hour=7)
-            ) for i, row in df.iterrows()
-        })
+                name=name,
+                job=job,
+                character=character,
+                initiative=initiative,
+                sociability=sociability,
+                area=rng.choice(areas),
+                hungry=hungry
+            )
+        return cls(agents=agents)
     
     @staticmethod
     def search_id(query: str) -> str | None:
-        result = re.search(r"agent_\d{3}", query)
+        result = re.search(r"agent_\d{3,}", query)
         return None if result is None else result.group()
     
     def search(self, query: str) -> Agent | None:
         return self.agents.get(self.search_id(query), None)
 
     def search(self, query: str) -> Agent | None:
-        return collection_search(self.agents, r"agent_\d{3}", query)
+        return collection_search(self.agents, r"agent_\d{3,}", query)
     
-    def send_action_logs(self, action_list: list[Action]) -> None:
+    def attach(self, store: LogStore) -> None:
+        for agent in self.agents.values():
+            if agent._log is None:
+                agent.attach(store)
+
+    def fork(self, store: LogStore) -> AgentList:
+        return AgentList(agents={agent_id: agent.fork(store) for agent_id, agent in self.agents.items()})
+
+    def send_action_logs(self, action_list: list[Action], store: LogStore) -> None:
         for action in action_list:
             for target in action.target:
-                self.agents[target.id].append_action_log(action.log(target))
+                self.agents[target.id].append_action_log(action.intern(store))
     
     def __iter__(self) -> Iterator[tuple[str, Agent]]:
         return iter(self.agents.items())
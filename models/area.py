@@ -1,15 +1,20 @@
 from __future__ import annotations
+from array import array
 import asyncio
 import json
 import re
+from time import perf_counter
 
-import pandas as pd
 from pydantic import BaseModel, Field, PrivateAttr
 
 from .agent import AgentList
 from .action import Action
+from .log import LogStore, LogView
 from utils.llm.base import LLM
+from utils.budget import Budgeter, Section
 from utils.functions import cleaned, collection_search
+from utils.hooks import Hooks
+from utils.loader import cached
 
 
 class Area(BaseModel):
@@ -17,8 +22,8 @@ class Area(BaseModel):
     name: str
     description: str
     agents: list[str] = Field(default_factory=list)
-    action_log: list[str] = Field(default_factory=list)
     summary: str = Field(default="")
+    _log: LogView | None = PrivateAttr(default=None)
 
     @property
     def name_with_id(self) -> str:
@@ -41,10 +46,33 @@ class Area(BaseModel):
             self.name_with_id, self.description, self.summary, people
         )
     
-    def append_action_log(self, *log: str) -> None:
-        self.action_log.extend(log)
+    @property
+    def action_log(self) -> list[str]:
+        return [] if self._log is None else self._log.render()
+
+    def attach(self, store: LogStore) -> None:
+        self._log = LogView(store, None)
+
+    def append_action_log(self, *index: int) -> None:
+        self._log.append(*index)
+
+    def fork(self, store: LogStore) -> Area:
+        area = self.model_copy()
+        area._log = None if self._log is None else self._log.fork(store)
+        return area
     
-    async def update_info(self, llm: LLM, global_info: str) -> str:
+    def _sections(self, global_info: str, budgeter: Budgeter | None) -> tuple[str, str]:
+        log = "\n".join(self.action_log)
+        if budgeter is None:
+            return global_info, log
+        texts = budgeter.fit(
+            "area.update_info",
+            Section(name="global", text=global_info, priority=1),
+            Section(name="log", text=log, priority=0, keep="tail")
+        )
+        return texts["global"], texts["log"]
+
+    async def update_info(self, llm: LLM, global_info: str, budgeter: Budgeter | None = None) -> str:
         prompt = cleaned(
             """
             あなたはとある人々が暮らす街の管理システムです。
@@ -63,10 +91,10 @@ class Area(BaseModel):
             ## 行動ログ
             {}
             """,
-            global_info, "\n".join(self.action_log)
+            *self._sections(global_info, budgeter)
         )
 
-        info = await llm.async_generate(
+        info = await llm.site("area.update_info").async_generate(
             prompt=prompt,
             messages=message
         )
@@ -76,30 +104,41 @@ class Area(BaseModel):
 
 class Location(BaseModel):
     areas: dict[str, Area]
-    _loads: pd.DataFrame = PrivateAttr()
+    _loads: array = PrivateAttr()
+    _index: dict[str, int] = PrivateAttr()
 
     @property
     def view(self) -> str:
         return "\n".join(area.name_with_id for area in self.areas.values())
 
-    @classmethod
-    def from_json_file(cls, filepath: str) -> Location:
-        with open(filepath) as f:
+    @staticmethod
+    def _compile(filepath: str) -> tuple[list[str], list[str], array]:
+        with open(filepath, encoding="utf-8") as f:
             data = json.load(f)
 
-        df = pd.DataFrame(data["distance_matrix"])
+        places = data["places"]
+        matrix = data["distance_matrix"]
+        loads = array("I")
+        for departure in places:
+            row = matrix[departure]
+            loads.extend((x := row[arrival]) // 10 + int(x % 10 >= 5) for arrival in places)
+        return places, [data["places_description"][name] for name in places], loads
+
+    @classmethod
+    def from_json_file(cls, filepath: str, cache_dir: str | None = None) -> Location:
+        places, descriptions, loads = cached(filepath, "location", lambda: cls._compile(filepath), cache_dir)
+
         areas = {
             (id := f"area_{str(i).zfill(2)}"): Area(
                 id=id, 
                 name=name,
-                description=data["places_description"][name]
-            ) for i, name in enumerate(data["places"])
+                description=description
+            ) for i, (name, description) in enumerate(zip(places, descriptions))
         }
-        df = df.set_axis(areas.keys(), axis="index").set_axis(areas.keys(), axis="columns")
-        df = df.map(lambda x: x // 10 + int(x % 10 >= 5))
 
         location = cls(areas=areas)
-        location._loads = df
+        location._loads = loads
+        location._index = {id: i for i, id in enumerate(areas.keys())}
         return location
     
     @staticmethod
@@ -110,12 +149,19 @@ class Location(BaseModel):
     def search(self, query: str) -> Area | None:
         return self.areas.get(self.search_id(query), None)
     
-    def update_log(self, action_logs: list[Action]) -> None:
-        logs = {area_id: [] for area_id in self.areas.keys()}
+    def attach(self, store: LogStore) -> None:
+        for area in self.areas.values():
+            if area._log is None:
+                area.attach(store)
+
+    def fork(self, store: LogStore) -> Location:
+        return self.model_copy(update={"areas": {area_id: area.fork(store) for area_id, area in self.areas.items()}})
+
+    def update_log(self, action_logs: list[Action], store: LogStore) -> None:
+        for area in self.areas.values():
+            area._log.clear()
         for action in action_logs:
-            logs[action.actor.area].append(action.log(None))
-        for area_id, log in logs.items():
-            self.areas[area_id].action_log = log
+            self.areas[action.actor.area].append_action_log(action.intern(store))
     
     def update_agents(self, agent_list: AgentList) -> None:
         agent_changes: dict[str, list[str]] = {}
@@ -128,14 +174,57 @@ class Location(BaseModel):
         for area_id, agents in agent_changes.items():
             self.areas[area_id].agents = agents
     
-    async def update(self, llm: LLM, action_logs: list[Action], agent_list: AgentList, global_info: str) -> None:
+    async def _timed_update(
+            self, 
+            area: Area, 
+            llm: LLM, 
+            global_info: str, 
+            budgeter: Budgeter | None, 
+            hooks: Hooks, 
+            tick: str
+    ) -> str:
+        start = perf_counter()
+        info = await area.update_info(llm, global_info, budgeter)
+        hooks.emit("on_area_updated", tick, start, perf_counter(), area=area)
+        return info
+
+    async def update(
+            self, 
+            llm: LLM, 
+            action_logs: list[Action], 
+            agent_list: AgentList, 
+            global_info: str,
+            store: LogStore,
+            hooks: Hooks | None = None,
+            tick: str = "",
+            budgeter: Budgeter | None = None,
+            timeout: float | None = None
+    ) -> int:
         self.update_agents(agent_list)
-        self.update_log(action_logs)
-        await asyncio.gather(*(area.update_info(llm, global_info) for area in self.areas.values()))
+        self.update_log(action_logs, store)
+        updates = [
+            self._timed_update(area, llm, global_info, budgeter, hooks, tick) if hooks
+            else area.update_info(llm, global_info, budgeter)
+            for area in self.areas.values()
+        ]
+        if timeout is None:
+            await asyncio.gather(*updates)
+            return 0
+
+        # areas that miss the deadline are cancelled before their summary is replaced, so they keep the previous one
+        tasks = [asyncio.create_task(update) for update in updates]
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        for task in done:
+            task.result()
+        return len(pending)
 
     def travel_time(self, departure: str, arrival: str) -> int:
         if not departure in self.areas:
             raise KeyError(departure)
         if not arrival in self.areas:
             raise KeyError(arrival)
-        return int(self._loads[departure][arrival])
+        return self._loads[self._index[departure] * len(self._index) + self._index[arrival]]
@@ -0,0 +1,116 @@
+from __future__ import annotations
+from array import array
+from collections.abc import Iterable, Iterator
+from itertools import chain, islice
+import sys
+from typing import NamedTuple, TYPE_CHECKING
+
+from pydantic import BaseModel, PrivateAttr
+
+if TYPE_CHECKING:
+    from .action import Action
+
+
+ACTOR = "\ue000"
+TARGET = "\ue001"
+YOU = "あなた"
+
+
+class LogEntry(NamedTuple):
+    text: str
+    actor: str | None = None
+    actor_name: str = ""
+    targets: tuple[str, ...] = ()
+    target_names: str = ""
+
+    def render(self, viewer: str | None) -> str:
+        if self.actor is None:
+            return self.text
+        actor = YOU if viewer is not None and viewer == self.actor else self.actor_name
+        target = YOU if viewer is not None and viewer in self.targets else self.target_names
+        return self.text.replace(ACTOR, actor).replace(TARGET, target)
+
+
+class LogStore(BaseModel):
+    _entries: list[LogEntry] = PrivateAttr(default_factory=list)
+    _parent: LogStore | None = PrivateAttr(default=None)
+    _base: int = PrivateAttr(default=0)
+
+    def __len__(self) -> int:
+        return self._base + len(self._entries)
+
+    def fork(self) -> LogStore:
+        # both stores stay append-only, so the prefix they share never changes
+        store = LogStore()
+        store._parent = self
+        store._base = len(self)
+        return store
+
+    def add(self, entry: LogEntry) -> int:
+        self._entries.append(entry)
+        return self._base + len(self._entries) - 1
+
+    def append(self, action: Action) -> int:
+        return self.add(LogEntry(
+            text=sys.intern(action.log_template()),
+            actor=action.actor.id,
+            actor_name=sys.intern(action.actor.name_with_id),
+            targets=tuple(target.id for target in action.target),
+            target_names=sys.intern("、".join(target.name_with_id for target in action.target))
+        ))
+
+    def append_text(self, text: str) -> int:
+        return self.add(LogEntry(text=text))
+
+    def entry(self, index: int) -> LogEntry:
+        store = self
+        while index < store._base:
+            store = store._parent
+        return store._entries[index - store._base]
+
+    def render(self, index: int, viewer: str | None) -> str:
+        return self.entry(index).render(viewer)
+
+
+class LogView:
+    __slots__ = ("store", "viewer", "indices", "shared")
+
+    def __init__(
+            self, 
+            store: LogStore, 
+            viewer: str | None, 
+            indices: Iterable[int] = (), 
+            shared: tuple[tuple[array, int], ...] = ()
+    ) -> None:
+        self.store = store
+        self.viewer = viewer
+        self.indices = array("I", indices)
+        self.shared = shared
+
+    def __len__(self) -> int:
+        return sum(length for _, length in self.shared) + len(self.indices)
+
+    def __iter__(self) -> Iterator[int]:
+        if not self.shared:
+            return iter(self.indices)
+        return chain(*(islice(indices, length) for indices, length in self.shared), self.indices)
+
+    def fork(self, store: LogStore) -> LogView:
+        shared = self.shared + ((self.indices, len(self.indices)),) if self.indices else self.shared
+        return LogView(store, self.viewer, shared=shared)
+
+    def append(self, *index: int) -> None:
+        self.indices.extend(index)
+
+    def clear(self) -> None:
+        self.indices = array("I")
+        self.shared = ()
+
+    def entries(self) -> list[LogEntry]:
+        return [self.store.entry(i) for i in self]
+
+    def render(self, start: int = 0) -> list[str]:
+        if not self.shared:
+            return [self.store.render(i, self.viewer) for i in self.indices[start:]]
+        indices = list(self)
+        return [self.store.render(i, self.viewer) for i in indices[start:]]
@@ -0,0 +1,445 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+import asyncio
+from collections.abc import Callable
+import multiprocessing
+from typing import Any
+
+from pydantic import BaseModel, PrivateAttr
+
+from .action import Action, EvaluationCache
+from .agent import Agent, AgentList
+from .area import Area, Location
+from .log import LogEntry
+from .society import Society, global_info
+import utils
+from utils import logger
+from utils.budget import Budgeter
+from utils import time as timeutils
+from utils.llm.base import LLM
+from utils.rng import Seed
+from utils.time import Clock
+
+
+class Transport(ABC):
+    @abstractmethod
+    def start(self, shards: int, llm_factory: Callable[[], LLM], areas_file: str) -> None:
+        pass
+
+    @abstractmethod
+    async def send(self, shard: int, message: tuple[str, Any]) -> None:
+        pass
+
+    @abstractmethod
+    async def recv(self, shard: int) -> Any:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+    async def request(self, shard: int, message: tuple[str, Any]) -> Any:
+        await self.send(shard, message)
+        return await self.recv(shard)
+
+    async def broadcast(self, messages: dict[int, tuple[str, Any]]) -> dict[int, Any]:
+        await asyncio.gather(*(self.send(shard, message) for shard, message in messages.items()))
+        replies = await asyncio.gather(*(self.recv(shard) for shard in messages.keys()))
+        return dict(zip(messages.keys(), replies))
+
+
+class LocalTransport(Transport):
+    def __init__(self, start_method: str = "spawn") -> None:
+        self._context = multiprocessing.get_context(start_method)
+        self._connections = []
+        self._processes = []
+
+    def start(self, shards: int, llm_factory: Callable[[], LLM], areas_file: str) -> None:
+        for shard in range(shards):
+            parent, child = self._context.Pipe()
+            process = self._context.Process(
+                target=_serve,
+                args=(child, shard, llm_factory, areas_file, utils.settings.cache_dir),
+                daemon=True
+            )
+            process.start()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+    async def send(self, shard: int, message: tuple[str, Any]) -> None:
+        self._connections[shard].send(message)
+
+    async def recv(self, shard: int) -> Any:
+        reply = await asyncio.get_running_loop().run_in_executor(None, self._connections[shard].recv)
+        if isinstance(reply, BaseException):
+            raise reply
+        return reply
+
+    def close(self) -> None:
+        for connection in self._connections:
+            try:
+                connection.send(("stop", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._connections, self._processes = [], []
+
+
+class Shard(BaseModel):
+    society: Society
+    owned: set[str]
+    members: set[str]
+
+    @classmethod
+    def create(
+            cls, 
+            location: Location, 
+            agents: dict[str, Agent], 
+            clock: int, 
+            owned: set[str], 
+            seed: int,
+            options: dict[str, Any] | None = None
+    ) -> Shard:
+        options = options or {}
+        society = Society.model_construct(
+            agent_list=AgentList(agents=agents),
+            location=location,
+            clock=Clock(*timeutils.evaluate(clock)),
+            evaluation_cache=None if options.get("evaluation_cache") is None else EvaluationCache(**options["evaluation_cache"]),
+            dialogue_turns=options.get("dialogue_turns", 0),
+            budgeter=None if options.get("budgeter") is None else Budgeter(**options["budgeter"]),
+            seed=seed
+        )
+        members = {agent.id for agent in agents.values() if agent.area in owned}
+        return cls(society=society, owned=owned, members=members)
+
+    @property
+    def local(self) -> list[Agent]:
+        return [self.society.agent_list.agents[agent_id] for agent_id in sorted(self.members)]
+
+    def adopt(self, agents: list[tuple[Agent, list[LogEntry]]], areas: list[Area] | None = None) -> None:
+        for area in areas or []:
+            area.attach(self.society.log_store)
+            self.society.location.areas[area.id] = area
+            self.owned.add(area.id)
+        for agent, entries in agents:
+            agent.attach(self.society.log_store, entries)
+            self.society.agent_list.agents[agent.id] = agent
+            self.members.add(agent.id)
+
+    def _emigrate(self, agents: list[Agent]) -> list[tuple[Agent, list[LogEntry]]]:
+        self.members.difference_update(agent.id for agent in agents)
+        return [(agent, agent.detach()) for agent in agents]
+
+    def release(self, area_ids: list[str]) -> dict[str, list[Any]]:
+        self.owned.difference_update(area_ids)
+        areas = [self.society.location.areas[area_id].model_copy() for area_id in area_ids]
+        for area in areas:
+            area._log = None
+        return {
+            "areas": areas,
+            "agents": self._emigrate([agent for agent in self.local if agent.area in area_ids])
+        }
+
+    async def step(
+            self, 
+            llm: LLM, 
+            info_text: str, 
+            inbox: dict[str, list[LogEntry]], 
+            arrivals: list[tuple[Agent, list[LogEntry]]]
+    ) -> dict[str, Any]:
+        society = self.society
+        store = society.log_store
+        society.info_text = info_text
+        self.adopt(arrivals)
+        interned: dict[LogEntry, int] = {}
+        for agent_id, entries in inbox.items():
+            for entry in entries:
+                if entry not in interned:
+                    interned[entry] = store.add(entry)
+                society.agent_list.agents[agent_id].append_action_log(interned[entry])
+
+        local = [agent for agent in self.local if agent.status != "死亡"]
+        local_ids = {agent.id for agent in local}
+        actions: list[Action] = [
+            action for action in await asyncio.gather(*(society.step(agent, llm) for agent in local))
+            if action is not None
+        ]
+        if society.evaluation_cache is not None:
+            society.evaluation_cache.commit()
+        if society.clock.tick in society._scheduled:
+            society._scheduled[society.clock.tick] = [
+                talk for talk in society._scheduled[society.clock.tick] if talk.speaker.id in local_ids
+            ]
+        actions.extend(society._scheduled_talks())
+        # a dialogue only runs here when every participant is on this shard
+        society._sessions = [
+            opener for opener in society._sessions 
+            if all(agent.id in local_ids for agent in [opener.speaker, *opener.target])
+        ]
+        if society._sessions:
+            await society._start_dialogues(llm)
+
+        outbox: dict[str, list[LogEntry]] = {}
+        for action in actions:
+            index = action.intern(store)
+            for target in action.target:
+                if target.id in local_ids:
+                    society.agent_list.agents[target.id].append_action_log(index)
+                else:
+                    outbox.setdefault(target.id, []).append(store.entry(index))
+
+        society.location.update_agents(AgentList(agents={agent.id: agent for agent in local}))
+        society.location.update_log(actions, store)
+        await asyncio.gather(*(
+            society.location.areas[area_id].update_info(llm, society.info, society.budgeter) for area_id in self.owned
+        ))
+        stats = self.stats()
+        if llm.telemetry is not None:
+            stats["telemetry"] = llm.telemetry.end_tick(society.clock.now)
+        society.clock.step()
+
+        emigrants = self._emigrate([agent for agent in self.local if agent.area not in self.owned])
+        occupancy = {area_id: 0 for area_id in self.owned}
+        for agent in self.local:
+            occupancy[agent.area] += 1
+        return {
+            "logs": [store.render(action.intern(store), None) for action in actions],
+            "outbox": outbox,
+            "emigrants": emigrants,
+            "occupancy": occupancy,
+            "stats": stats
+        }
+
+    def stats(self) -> dict[str, Any]:
+        society = self.society
+        cache = society.evaluation_cache
+        return {
+            "members": len(self.members),
+            "areas": len(self.owned),
+            "cache_hits": 0 if cache is None else cache.hits,
+            "cache_misses": 0 if cache is None else cache.misses,
+            "budget_cuts": {} if society.budgeter is None else society.budgeter.cuts,
+            "telemetry": None
+        }
+
+
+def _serve(connection: Any, shard_id: int, llm_factory: Callable[[], LLM], areas_file: str, cache_dir: str | None) -> None:
+    async def serve() -> None:
+        llm = llm_factory()
+        location = Location.from_json_file(areas_file, cache_dir)
+        shard: Shard | None = None
+        while True:
+            kind, payload = connection.recv()
+            try:
+                if kind == "stop":
+                    return
+                elif kind == "init":
+                    shard = Shard.create(
+                        location, 
+                        payload["agents"], 
+                        payload["clock"], 
+                        set(payload["owned"]), 
+                        payload["seed"],
+                        payload["options"]
+                    )
+                    reply = None
+                elif kind == "step":
+                    reply = await shard.step(llm, payload["info_text"], payload["inbox"], payload["arrivals"])
+                elif kind == "release":
+                    reply = shard.release(payload)
+                elif kind == "adopt":
+                    shard.adopt(payload["agents"], payload["areas"])
+                    reply = None
+                else:
+                    raise ValueError(f"`kind`: {kind}")
+            except Exception as e:
+                reply = e
+            connection.send(reply)
+
+    asyncio.run(serve())
+
+
+class ShardedSociety(BaseModel):
+    location: Location
+    clock: Clock
+    info_text: str = ""
+    shards: int
+    rebalance_threshold: float = 1.5
+    seed: int
+    evaluation_cache: EvaluationCache | None = None
+    dialogue_turns: int = 0
+    budgeter: Budgeter | None = None
+    _transport: Transport = PrivateAttr()
+    _assignment: dict[str, int] = PrivateAttr(default_factory=dict)
+    _agent_shard: dict[str, int] = PrivateAttr(default_factory=dict)
+    _inbox: list[dict[str, list[LogEntry]]] = PrivateAttr(default_factory=list)
+    _arrivals: list[list[tuple[Agent, list[LogEntry]]]] = PrivateAttr(default_factory=list)
+    _occupancy: dict[str, int] = PrivateAttr(default_factory=dict)
+    _pending: dict[str, Agent] = PrivateAttr(default_factory=dict)
+    _stats: dict[int, dict[str, Any]] = PrivateAttr(default_factory=dict)
+
+    @property
+    def info(self) -> str:
+        return self.info_at()
+
+    def info_at(self, offset: int = 0) -> str:
+        return global_info(self.clock, self.location, self.info_text, offset)
+
+    @property
+    def assignment(self) -> dict[str, int]:
+        return self._assignment
+
+    @property
+    def stats(self) -> dict[int, dict[str, Any]]:
+        return self._stats
+
+    @property
+    def cache_hit_rate(self) -> float:
+        hits = sum(stats["cache_hits"] for stats in self._stats.values())
+        total = hits + sum(stats["cache_misses"] for stats in self._stats.values())
+        return hits / total if total else 0.0
+
+    def __init__(
+            self,
+            llm_factory: Callable[[], LLM],
+            shards: int,
+            agents_file: str | None = None,
+            areas_file: str | None = None,
+            clock: Clock | None = None,
+            transport: Transport | None = None,
+            rebalance_threshold: float = 1.5,
+            seed: int | None = None,
+            evaluation_cache: EvaluationCache | None = None,
+            dialogue_turns: int = 0,
+            budgeter: Budgeter | None = None
+    ) -> None:
+        root = Seed.create(seed)
+        if agents_file is None:
+            agents_file = utils.settings.agents_file
+        if areas_file is None:
+            areas_file = utils.settings.areas_file
+        location = Location.from_json_file(areas_file, utils.settings.cache_dir)
+        agent_list = AgentList.from_json_file(
+            agents_file, 
+            list(location.areas.keys()), 
+            utils.settings.cache_dir, 
+            root.spawn("init").random()
+        )
+        if clock is None:
+            clock = Clock()
+        super().__init__(
+            location=location, 
+            clock=clock, 
+            shards=shards, 
+            rebalance_threshold=rebalance_threshold, 
+            seed=root.entropy,
+            evaluation_cache=evaluation_cache,
+            dialogue_turns=dialogue_turns,
+            budgeter=budgeter
+        )
+
+        self._occupancy = {area_id: 0 for area_id in location.areas.keys()}
+        for _, agent in agent_list:
+            self._occupancy[agent.area] += 1
+        self._assignment = self._partition(self._occupancy)
+        self._agent_shard = {agent.id: self._assignment[agent.area] for _, agent in agent_list}
+        self._inbox = [{} for _ in range(shards)]
+        self._arrivals = [[] for _ in range(shards)]
+
+        self._transport = LocalTransport() if transport is None else transport
+        self._transport.start(shards, llm_factory, areas_file)
+        self._pending = agent_list.agents
+
+    def _partition(self, occupancy: dict[str, int]) -> dict[str, int]:
+        loads = [0] * self.shards
+        assignment = {}
+        for area_id, count in sorted(occupancy.items(), key=lambda x: (-x[1], x[0])):
+            shard = min(range(self.shards), key=lambda i: (loads[i], i))
+            assignment[area_id] = shard
+            loads[shard] += count
+        return assignment
+
+    async def start(self) -> None:
+        agents, self._pending = self._pending, {}
+        await self._transport.broadcast({
+            shard: ("init", {
+                "agents": agents,
+                "clock": self.clock.tick,
+                "seed": self.seed,
+                "owned": [area_id for area_id, s in self._assignment.items() if s == shard],
+                "options": self._options()
+            }) for shard in range(self.shards)
+        })
+
+    def _options(self) -> dict[str, Any]:
+        # workers build their own cache and budgeter from these, so only plain settings cross the process boundary
+        return {
+            "evaluation_cache": None if self.evaluation_cache is None else {"threshold": self.evaluation_cache.threshold},
+            "dialogue_turns": self.dialogue_turns,
+            "budgeter": None if self.budgeter is None else self.budgeter.model_dump()
+        }
+
+    def close(self) -> None:
+        self._transport.close()
+
+    async def rebalance(self, force: bool = False) -> bool:
+        loads = [0] * self.shards
+        for area_id, count in self._occupancy.items():
+            loads[self._assignment[area_id]] += count
+        mean = sum(loads) / self.shards
+        if not force and (mean == 0 or max(loads) <= self.rebalance_threshold * mean):
+            return False
+
+        assignment = self._partition(self._occupancy)
+        moves: dict[tuple[int, int], list[str]] = {}
+        for area_id, shard in assignment.items():
+            if self._assignment[area_id] != shard:
+                moves.setdefault((self._assignment[area_id], shard), []).append(area_id)
+        for (source, destination), area_ids in moves.items():
+            released = await self._transport.request(source, ("release", area_ids))
+            await self._transport.request(destination, ("adopt", released))
+            for agent, _ in released["agents"]:
+                self._agent_shard[agent.id] = destination
+        self._assignment = assignment
+        return bool(moves)
+
+    async def step_all(self, debug: bool = False) -> list[str]:
+        logger.print(f"ステップ開始: {self.clock.now}", debug)
+        replies = await self._transport.broadcast({
+            shard: ("step", {
+                "info_text": self.info_text,
+                "inbox": self._inbox[shard],
+                "arrivals": self._arrivals[shard]
+            }) for shard in range(self.shards)
+        })
+        logger.print(f"全シャード同期完了", debug)
+
+        logs, emigrants = [], []
+        for shard in range(self.shards):
+            logs.extend(replies[shard]["logs"])
+            emigrants.extend(replies[shard]["emigrants"])
+            self._occupancy.update(replies[shard]["occupancy"])
+            self._stats[shard] = replies[shard]["stats"]
+        for agent, _ in emigrants:
+            self._occupancy[agent.area] += 1
+
+        if await self.rebalance():
+            logger.print(f"シャード再配置完了", debug)
+
+        self._inbox = [{} for _ in range(self.shards)]
+        self._arrivals = [[] for _ in range(self.shards)]
+        for agent, entries in emigrants:
+            destination = self._assignment[agent.area]
+            self._agent_shard[agent.id] = destination
+            self._arrivals[destination].append((agent, entries))
+        for shard in range(self.shards):
+            for agent_id, lines in replies[shard]["outbox"].items():
+                self._inbox[self._agent_shard[agent_id]].setdefault(agent_id, []).extend(lines)
+
+        self.clock.step()
+        logger.print(f"ステップ終了", debug)
+        return logs
@@ -1,53 +1,181 @@
 from __future__ import annotations
 import asyncio
+import random
+from time import perf_counter
+from typing import Any, Literal, NamedTuple
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
-from .action import Action, Dead, Wait, Talk, Eat, Sleep, Move, OtherAction
+from .action import Action, Dead, Wait, Talk, Eat, Sleep, Move, OtherAction, Dialogue, EvaluationCache
 from .agent import Agent, AgentList
 from .area import Location
-from utils import settings
+from .log import LogStore
+from .world import WorldSummary
+import utils
+from utils.budget import Budgeter
 from utils.functions import cleaned
 from utils.llm.base import LLM
 from utils import logger
+from utils.hooks import Hooks
+from utils.rng import Seed
 from utils.time import Clock
 
 
+class Speculation(NamedTuple):
+    tick: int
+    fingerprint: tuple[str, tuple[str, ...], int]
+    task: asyncio.Task
+
+
+def global_info(clock: Clock, location: Location, info_text: str, offset: int = 0) -> str:
+    return cleaned(
+        """
+        ■現在時刻: {time},
+
+        ■移動可能エリア
+        {area}
+
+        ■情報
+        {info}
+        """,
+        time=clock.at(offset),
+        area=location.view,
+        info=info_text
+    )
+
+
 class Society(BaseModel):
     agent_list: AgentList
     location: Location
     info_text: str = ""
     clock: Clock
+    evaluation_cache: EvaluationCache | None = None
+    dialogue_turns: int = 0
+    seed: int
+    deadline: float | None = None
+    late_policy: Literal["cancel", "carry"] = "cancel"
+    urgent_grace: float = 0.5
+    decide_share: float = 0.6
+    budgeter: Budgeter | None = None
+    speculate: bool = False
+    world: WorldSummary | None = None
+    _hooks: Hooks = PrivateAttr(default_factory=Hooks)
+    _log_store: LogStore = PrivateAttr(default_factory=LogStore)
+    _sessions: list[Talk] = PrivateAttr(default_factory=list)
+    _scheduled: dict[int, list[Talk]] = PrivateAttr(default_factory=dict)
+    _carried: dict[str, asyncio.Task] = PrivateAttr(default_factory=dict)
+    _shed: list[int] = PrivateAttr(default_factory=list)
+    _speculations: dict[str, Speculation] = PrivateAttr(default_factory=dict)
+    _speculation_stats: dict[str, int] = PrivateAttr(default_factory=lambda: {"hits": 0, "misses": 0})
+
+    @property
+    def hooks(self) -> Hooks:
+        return self._hooks
+
+    @property
+    def log_store(self) -> LogStore:
+        return self._log_store
+
+    @property
+    def shed(self) -> list[int]:
+        return self._shed
+
+    @property
+    def speculation_hit_rate(self) -> float:
+        total = self._speculation_stats["hits"] + self._speculation_stats["misses"]
+        return self._speculation_stats["hits"] / total if total else 0.0
+
+    def rng(self, agent: Agent) -> random.Random:
+        return Seed(entropy=self.seed).spawn("agent", agent.id, self.clock.tick).random()
+
+    def model_post_init(self, context) -> None:
+        self.agent_list.attach(self._log_store)
+        self.location.attach(self._log_store)
 
     @property
     def info(self) -> str:
-        return cleaned(
-            """
-            ■現在時刻: {time},
-
-            ■移動可能エリア
-            {area}
-
-            ■情報
-            {info}
-            """,
-            time=self.clock.now,
-            area=self.location.view,
-            info=self.info_text
-        )
+        return self.info_at()
+
+    def info_at(self, offset: int = 0) -> str:
+        info = global_info(self.clock, self.location, self.info_text, offset)
+        if self.world is None or not self.world.summary:
+            return info
+        return f"{info}\n\n■街全体の様子\n{self.world.text(self.budgeter)}"
     
     def __init__(
             self,
-            agents_file: str=settings.agents_file,
-            areas_file: str=settings.areas_file,
-            clock: Clock | None=None
+            agents_file: str | None=None,
+            areas_file: str | None=None,
+            clock: Clock | None=None,
+            evaluation_cache: EvaluationCache | None=None,
+            dialogue_turns: int=0,
+            seed: int | None=None,
+            deadline: float | None=None,
+            late_policy: Literal["cancel", "carry"]="cancel",
+            urgent_grace: float=0.5,
+            decide_share: float=0.6,
+            budgeter: Budgeter | None=None,
+            speculate: bool=False,
+            world: WorldSummary | None=None
     ) -> None:
-        location = Location.from_json_file(areas_file)
-        agent_list = AgentList.from_json_file(agents_file, list(location.areas.keys()))
+        root = Seed.create(seed)
+        if agents_file is None:
+            agents_file = utils.settings.agents_file
+        if areas_file is None:
+            areas_file = utils.settings.areas_file
+        location = Location.from_json_file(areas_file, utils.settings.cache_dir)
+        agent_list = AgentList.from_json_file(
+            agents_file, 
+            list(location.areas.keys()), 
+            utils.settings.cache_dir, 
+            root.spawn("init").random()
+        )
         location.update_agents(agent_list)
         if clock is None:
             clock = Clock()
-        super().__init__(agent_list=agent_list, location=location, clock=clock)
+        super().__init__(
+            agent_list=agent_list, 
+            location=location, 
+            clock=clock, 
+            evaluation_cache=evaluation_cache,
+            dialogue_turns=dialogue_turns,
+            seed=root.entropy,
+            deadline=deadline,
+            late_policy=late_policy,
+            urgent_grace=urgent_grace,
+            decide_share=decide_share,
+            budgeter=budgeter,
+            speculate=speculate,
+            world=world
+        )
+
+    def fork(self, seed: int | None = None) -> Society:
+        # in-flight speculations and carried decisions stay with the parent
+        store = self._log_store.fork()
+        agent_list = self.agent_list.fork(store)
+        society = self.model_copy(update={
+            "agent_list": agent_list,
+            "location": self.location.fork(store),
+            "clock": Clock(*self.clock.evaluate),
+            "seed": self.seed if seed is None else seed,
+            "world": None if self.world is None else self.world.fork()
+        })
+        society._hooks = Hooks()
+        society._log_store = store
+        society._sessions = []
+        society._scheduled = {
+            tick: [
+                talk.model_copy(update={
+                    "actor": agent_list.agents[talk.actor.id],
+                    "target": [agent_list.agents[target.id] for target in talk.target]
+                }) for talk in talks
+            ] for tick, talks in self._scheduled.items()
+        }
+        society._carried = {}
+        society._shed = []
+        society._speculations = {}
+        society._speculation_stats = {"hits": 0, "misses": 0}
+        return society
 
     async def evaluate_action(
             self, 
@@ -67,10 +195,12 @@ class Society(BaseModel):
             if action_type == "talk":
                 assert target
                 action = Talk(actor, target, self.clock.now, raw_action["content"], raw_action)
+                if self.dialogue_turns > 0:
+                    self._sessions.append(action)
             elif action_type == "eat":
                 action = Eat(actor, self.clock.now, raw_action["food"], raw_action)
             elif action_type == "sleep":
-                action = Sleep(actor, self.clock.now, raw_action)
+                action = Sleep(actor, self.clock.now, raw_action.get("faint", False), raw_action, self.rng(actor))
             elif action_type == "move":
                 assert (destination := self.location.search(raw_action["destination"]))
                 duration = self.location.travel_time(actor.area, destination.id)
@@ -87,7 +217,9 @@ class Society(BaseModel):
                     raw_action, 
                     actor, 
                     self.location.areas[actor.area].name_with_id,
-                    llm
+                    llm,
+                    self.evaluation_cache,
+                    self.budgeter
                 )
                 assert evaluated_action.allow
                 action = OtherAction(
@@ -105,10 +237,78 @@ class Society(BaseModel):
 
         return action
     
-    async def step(self, agent: Agent, llm: LLM) -> Action | None:
-        if agent.status == "行動可能":
-            raw_action = await agent.act(llm, self.location.search(agent.area).info, self.info)
-            action = await self.evaluate_action(agent, raw_action, llm)
+    def _fingerprint(self, agent: Agent, area_id: str) -> tuple[str, tuple[str, ...], int]:
+        # the agent itself is left out: a moving agent is still listed in its old area when speculation starts
+        name = agent.info.rsplit(":", 1)[0]
+        occupants = tuple(sorted(
+            occupant for info in self.location.areas[area_id].agents if (occupant := info.rsplit(":", 1)[0]) != name
+        ))
+        return area_id, occupants, len(agent._log or ())
+
+    def _speculate(self, llm: LLM) -> None:
+        for _, agent in self.agent_list:
+            if agent.status in ("行動可能", "死亡") or agent.action_timer != 1 or agent.id in self._speculations:
+                continue
+            area_id = agent.moving_to if agent.status == "移動中" else agent.area
+            projected = agent.model_copy(update={
+                "area": area_id,
+                "moving_to": None,
+                "status": "行動可能",
+                "action_timer": 0,
+                "sleepiness": agent.sleepiness + 1,
+                "hungry": agent.hungry + 1
+            })
+            task = asyncio.create_task(projected.deliberate(
+                llm, self.location.areas[area_id].info, self.info_at(1), self.budgeter
+            ))
+            self._speculations[agent.id] = Speculation(
+                tick=self.clock.tick + 1, 
+                fingerprint=self._fingerprint(agent, area_id), 
+                task=task
+            )
+
+    async def _speculated(self, agent: Agent) -> dict[str, Any] | None:
+        speculation = self._speculations.pop(agent.id, None)
+        if speculation is None:
+            return None
+        if speculation.tick != self.clock.tick or speculation.fingerprint != self._fingerprint(agent, agent.area):
+            speculation.task.cancel()
+            self._speculation_stats["misses"] += 1
+            return None
+        try:
+            agent.thinking, raw_action = await speculation.task
+        except Exception:
+            self._speculation_stats["misses"] += 1
+            return None
+        self._speculation_stats["hits"] += 1
+        return raw_action
+
+    async def _act(self, agent: Agent, llm: LLM) -> dict[str, Any]:
+        if self._speculations and (raw_action := await self._speculated(agent)) is not None:
+            return raw_action
+        return await agent.act(llm, self.location.search(agent.area).info, self.info, self.budgeter)
+
+    async def decide(self, agent: Agent, llm: LLM) -> Action | None:
+        if not self._hooks:
+            raw_action = await self._act(agent, llm)
+            return await self.evaluate_action(agent, raw_action, llm)
+
+        start = perf_counter()
+        raw_action = await self._act(agent, llm)
+        decided = perf_counter()
+        self._hooks.emit(
+            "on_agent_decided", self.clock.now, start, decided, 
+            agent=agent, raw_action=raw_action
+        )
+        action = await self.evaluate_action(agent, raw_action, llm)
+        self._hooks.emit(
+            "on_action_evaluated", self.clock.now, decided, perf_counter(), 
+            agent=agent, action=action
+        )
+        return action
+
+    def advance(self, agent: Agent, action: Action | None, decided: bool) -> Action | None:
+        if decided:
             if action is None:
                 agent.status = "死亡"
                 action
@@ -117,9 +317,7 @@ class Society(BaseModel):
                 if isinstance(action, Move):
                     agent.moving_to = self.location.search_id(action.destination)
                 agent.status = action.status
-                agent.append_action_log(action.log(agent))
-        else:
-            action = None
+                agent.append_action_log(action.intern(self._log_store))
         
         agent.action_timer += -1
         agent.sleepiness += 1
@@ -131,18 +329,151 @@ class Society(BaseModel):
             agent.status = "行動可能"
 
         return action
+
+    async def step(self, agent: Agent, llm: LLM) -> Action | None:
+        if agent.status == "行動可能":
+            return self.advance(agent, await self.decide(agent, llm), True)
+        return self.advance(agent, None, False)
+
+    def _remaining(self, end: float | None) -> float | None:
+        return None if end is None else max(end - asyncio.get_running_loop().time(), 0.0)
+
+    async def _step_realtime(self, llm: LLM, end: float) -> list[Action | None]:
+        agents = [agent for _, agent in self.agent_list if agent.status != "死亡"]
+        free = sorted(
+            (agent for agent in agents if agent.status == "行動可能"), 
+            key=lambda agent: agent.urgency, 
+            reverse=True
+        )
+        carried, self._carried = self._carried, {}
+        tasks = {
+            agent.id: carried.pop(agent.id, None) or asyncio.create_task(self.decide(agent, llm))
+            for agent in free
+        }
+        for task in carried.values():
+            task.cancel()
+
+        if tasks:
+            _, pending = await asyncio.wait(tasks.values(), timeout=self._remaining(end))
+            urgent = [tasks[agent.id] for agent in free if agent.urgency >= 1 and tasks[agent.id] in pending]
+            if urgent and self.urgent_grace > 0:
+                # late non-urgent decisions give up their LLM slots to the urgent ones
+                if self.late_policy == "cancel":
+                    for task in pending.difference(urgent):
+                        task.cancel()
+                await asyncio.wait(urgent, timeout=self.urgent_grace)
+
+        shed, decisions = 0, {}
+        for agent in free:
+            task = tasks[agent.id]
+            if task.done() and not task.cancelled() and task.exception() is None:
+                decisions[agent.id] = task.result()
+                continue
+            if not task.done() and self.late_policy == "carry":
+                self._carried[agent.id] = task
+            else:
+                task.cancel()
+            shed += 1
+            decisions[agent.id] = Wait(agent, self.clock.now, {"type": "wait", "shed": True})
+        self._shed.append(shed)
+
+        return [
+            self.advance(agent, decisions.get(agent.id), agent.id in decisions) 
+            for agent in agents
+        ]
+
+    async def _start_dialogues(self, llm: LLM, timeout: float | None = None) -> None:
+        engaged, openers = set(), []
+        for opener in sorted(self._sessions, key=lambda opener: opener.speaker.id):
+            participants = [opener.speaker, *opener.target]
+            if any(agent.status != "行動可能" or agent.id in engaged for agent in participants):
+                continue
+            engaged.update(agent.id for agent in participants)
+            openers.append(opener)
+        self._sessions = []
+
+        tasks = [
+            asyncio.create_task(Dialogue.generate(
+                opener, self.location.search(opener.speaker.area).info, self.dialogue_turns, llm
+            )) for opener in openers
+        ]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        for opener, task in zip(openers, tasks):
+            if not task.done():
+                task.cancel()
+                continue
+            if task.exception() is not None:
+                continue
+            talks = task.result().talks(opener, self.clock, self.dialogue_turns)
+            if not talks:
+                continue
+            for i, talk in enumerate(talks, start=1):
+                self._scheduled.setdefault(self.clock.tick + i, []).append(talk)
+            for agent in [opener.speaker, *opener.target]:
+                agent.status = "行動中"
+                agent.action_timer = len(talks)
+
+    def _scheduled_talks(self) -> list[Talk]:
+        talks = [talk for talk in self._scheduled.pop(self.clock.tick, []) if talk.speaker.status != "死亡"]
+        for talk in talks:
+            talk.speaker.append_action_log(talk.intern(self._log_store))
+        return talks
     
     async def step_all(self, llm: LLM, debug: bool=False) -> list[Action]:
         logger.print(f"ステップ開始: {self.clock.now}", debug)
+        hooks = self._hooks if self._hooks else None
+        if hooks:
+            tick_start = perf_counter()
+            hooks.emit("on_tick_start", self.clock.now, tick_start, tick_start)
 
-        actions = await asyncio.gather(*(self.step(agent, llm) for _, agent in self.agent_list if agent.status != "死亡"))
+        if self.deadline is None:
+            end = None
+            actions = await asyncio.gather(*(self.step(agent, llm) for _, agent in self.agent_list if agent.status != "死亡"))
+        else:
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            actions = await self._step_realtime(llm, start + self.deadline * self.decide_share)
+            # dialogues, areas and the world keep their share even when urgent decisions used the grace period
+            end = max(start + self.deadline, loop.time() + self.deadline * (1 - self.decide_share))
+            logger.print(f"期限超過により{self._shed[-1]}件の意思決定を破棄", debug and self._shed[-1] > 0)
         actions = [action for action in actions if not action is None]
-        self.agent_list.send_action_logs(actions)
+        if self.evaluation_cache is not None:
+            self.evaluation_cache.commit()
+        actions.extend(self._scheduled_talks())
+        if self._sessions:
+            await self._start_dialogues(llm, self._remaining(end))
+        if hooks:
+            start = perf_counter()
+            self.agent_list.send_action_logs(actions, self._log_store)
+            hooks.emit("on_logs_dispatched", self.clock.now, start, perf_counter(), actions=actions)
+        else:
+            self.agent_list.send_action_logs(actions, self._log_store)
         logger.print(f"アクション宣言完了", debug)
 
-        await self.location.update(llm, actions, self.agent_list, self.info)
-        logger.print(f"エリア更新完了", debug)
+        late = await self.location.update(
+            llm, actions, self.agent_list, self.info, self._log_store, hooks, self.clock.now, self.budgeter,
+            self._remaining(end)
+        )
+        logger.print(f"エリア更新完了" + (f" (期限超過により{late}件は前回の情報を維持)" if late else ""), debug)
+
+        if self.world is not None:
+            try:
+                if await asyncio.wait_for(self.world.update(llm, self.location, self.budgeter), self._remaining(end)):
+                    logger.print(f"街全体の情報更新完了", debug)
+            except asyncio.TimeoutError:
+                logger.print(f"期限超過により街全体の情報は前回のまま", debug)
+
+        if llm.telemetry is not None:
+            llm.telemetry.end_tick(self.clock.now)
 
+        if hooks:
+            hooks.emit(
+                "on_tick_end", self.clock.now, tick_start, perf_counter(), 
+                actions=actions, shed=self._shed[-1] if self.deadline is not None else 0
+            )
         self.clock.step()
+        if self.speculate:
+            self._speculate(llm)
         logger.print(f"ステップ終了", debug)
         return actions
@@ -0,0 +1,170 @@
+from __future__ import annotations
+import asyncio
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+from .area import Location
+from utils.budget import Budgeter, Section
+from utils.functions import cleaned
+from utils.llm.base import LLM
+from utils.similarity import MinHash
+
+
+Signature = tuple[int, ...]
+
+
+def cluster(location: Location, size: int) -> list[list[str]]:
+    # capacity-bounded k-medoids, so remote areas do not end up as districts of one
+    ids = list(location.areas.keys())
+    size = max(1, min(size, len(ids)))
+    capacity = -(-len(ids) // size)
+    distance = {
+        (a, b): (location.travel_time(a, b) + location.travel_time(b, a)) / 2 for a in ids for b in ids
+    }
+    medoids = [ids[0]]
+    while len(medoids) < size:
+        medoids.append(max(ids, key=lambda a: (min(distance[a, m] for m in medoids), a not in medoids)))
+
+    for _ in range(20):
+        groups: dict[str, list[str]] = {medoid: [] for medoid in medoids}
+        assigned = set()
+        for _, area_id, medoid in sorted((distance[a, m], a, m) for a in ids for m in medoids):
+            if area_id not in assigned and len(groups[medoid]) < capacity:
+                groups[medoid].append(area_id)
+                assigned.add(area_id)
+        updated = [
+            min(members, key=lambda a: (sum(distance[a, b] for b in members), a))
+            for members in groups.values()
+        ]
+        if updated == medoids:
+            break
+        medoids = updated
+    return [members for members in groups.values() if members]
+
+
+class District(BaseModel):
+    id: str
+    area_ids: list[str]
+    summary: str = ""
+    stale: int = 0
+    _signatures: dict[str, Signature] = PrivateAttr(default_factory=dict)
+
+
+class WorldSummary(BaseModel):
+    size: int | None = None
+    districts: list[District] = Field(default_factory=list)
+    summary: str = ""
+    change_ratio: float = 0.34
+    similarity: float = 0.6
+    max_calls: int = 4
+    max_tokens: int = 200
+    _minhash: MinHash = PrivateAttr(default_factory=MinHash)
+    _signatures: dict[str, Signature] = PrivateAttr(default_factory=dict)
+    _calls: list[int] = PrivateAttr(default_factory=list)
+
+    @property
+    def calls(self) -> list[int]:
+        return self._calls
+
+    def text(self, budgeter: Budgeter | None = None) -> str:
+        return (budgeter or Budgeter()).truncate(self.summary, self.max_tokens)
+
+    def fork(self) -> WorldSummary:
+        world = self.model_copy(update={"districts": [district.model_copy() for district in self.districts]})
+        world._calls = []
+        return world
+
+    def _changed(self, children: dict[str, str], seen: dict[str, Signature]) -> tuple[float, dict[str, Signature]]:
+        signatures = {key: self._minhash.signature(text) for key, text in children.items() if text}
+        if not signatures:
+            return 0.0, signatures
+        changed = sum(
+            1 for key, signature in signatures.items()
+            if key not in seen or MinHash.similarity(signature, seen[key]) < self.similarity
+        )
+        return changed / len(children), signatures
+
+    async def _summarize_district(
+            self,
+            district: District,
+            llm: LLM,
+            location: Location,
+            signatures: dict[str, Signature],
+            budgeter: Budgeter | None
+    ) -> None:
+        areas = "\n".join(
+            f"- {location.areas[area_id].name_with_id}: {location.areas[area_id].summary}"
+            for area_id in district.area_ids if location.areas[area_id].summary
+        )
+        if budgeter is not None:
+            areas = budgeter.fit("world.district", Section(name="areas", text=areas))["areas"]
+        prompt = cleaned(
+            """
+            あなたはとある人々が暮らす街の管理システムです。
+            近接するエリア群 ({district}) の各エリアの状況をもとに、この地区の様子をまとめてください。
+            ### 方針
+            - 1~2行程度で簡潔にまとめる。
+            - 複数のエリアにまたがる動きや、大きな影響を与えうる出来事を優先する。
+            """,
+            district=district.id
+        )
+        district.summary = await llm.site("world.district").async_generate(prompt=prompt, messages=areas)
+        district._signatures = signatures
+        district.stale = 0
+
+    async def _summarize_city(self, llm: LLM, signatures: dict[str, Signature], budgeter: Budgeter | None) -> None:
+        districts = "\n".join(f"- {district.id}: {district.summary}" for district in self.districts if district.summary)
+        if budgeter is not None:
+            districts = budgeter.fit("world.city", Section(name="districts", text=districts))["districts"]
+        prompt = cleaned(
+            """
+            あなたはとある人々が暮らす街の管理システムです。
+            各地区の様子をもとに、街全体の現在の状況をまとめてください。
+            ### 方針
+            - 2~3行程度で簡潔にまとめる。
+            - 住民全員が知っておくべき出来事を優先し、特になければ街の雰囲気を描写する。
+            """
+        )
+        self.summary = await llm.site("world.city").async_generate(prompt=prompt, messages=districts)
+        self._signatures = signatures
+
+    async def update(self, llm: LLM, location: Location, budgeter: Budgeter | None = None) -> bool:
+        if not self.districts:
+            size = self.size or max(1, round(len(location.areas) ** 0.5))
+            self.districts = [
+                District(id=f"district_{str(i).zfill(2)}", area_ids=area_ids)
+                for i, area_ids in enumerate(cluster(location, size))
+            ]
+
+        candidates = []
+        for district in self.districts:
+            ratio, signatures = self._changed(
+                {area_id: location.areas[area_id].summary for area_id in district.area_ids},
+                district._signatures
+            )
+            if ratio >= self.change_ratio:
+                candidates.append((ratio, district, signatures))
+            else:
+                district.stale = 0
+        candidates.sort(key=lambda x: (-x[1].stale, -x[0], x[1].id))
+
+        budget = self.max_calls - 1 if self.max_calls > 1 else self.max_calls
+        chosen, waiting = candidates[:budget], candidates[budget:]
+        for _, district, _ in waiting:
+            district.stale += 1
+        await asyncio.gather(*(
+            self._summarize_district(district, llm, location, signatures, budgeter)
+            for _, district, signatures in chosen
+        ))
+        calls = len(chosen)
+
+        city = False
+        if calls < self.max_calls:
+            ratio, signatures = self._changed(
+                {district.id: district.summary for district in self.districts}, self._signatures
+            )
+            if ratio >= self.change_ratio:
+                await self._summarize_city(llm, signatures, budgeter)
+                calls, city = calls + 1, True
+        self._calls.append(calls)
+        return city
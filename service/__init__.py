@@ -0,0 +1,2 @@
+from .host import Host, Observer, Tenant
+from .server import Server
@@ -0,0 +1,38 @@
+import argparse
+import asyncio
+
+from .host import Host
+from .server import Server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m service")
+    parser.add_argument("--backend", choices=["openai", "gemini"], default="openai")
+    parser.add_argument("--model", default="gpt-4.1-mini")
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.backend == "openai":
+        from utils.llm import OpenAI as Backend
+    else:
+        from utils.llm import Gemini as Backend
+    host = Host(llm=Backend().model(args.model), concurrency=args.concurrency)
+    server = Server(host=host, address=args.address, port=args.port, queue_size=args.queue_size)
+
+    async def serve() -> None:
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
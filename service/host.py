@@ -0,0 +1,228 @@
+from __future__ import annotations
+import asyncio
+from collections import deque
+from typing import Any, Literal
+
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+
+from models import Society
+from models.action import EvaluationCache
+from utils import logger
+from utils.llm.base import LLM
+
+
+# a full mailbox drops its oldest message, so a slow reader loses history instead of holding up the tick
+class Observer:
+    def __init__(self, maxsize: int = 64) -> None:
+        self._queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, message: dict[str, Any]) -> None:
+        while True:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except asyncio.QueueFull:
+                self._queue.get_nowait()
+                self.dropped += 1
+
+    async def get(self) -> dict[str, Any]:
+        return await self._queue.get()
+
+
+class Tenant(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    id: str
+    society: Society
+    llm: LLM
+    state: Literal["paused", "running"] = "paused"
+    remaining: int | None = 0
+    ticks: int = 0
+    error: str | None = None
+    _observers: set[Observer] = PrivateAttr(default_factory=set)
+    _stepping: bool = PrivateAttr(default=False)
+
+    @property
+    def runnable(self) -> bool:
+        return self.state == "running" and self.remaining != 0
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "remaining": self.remaining,
+            "ticks": self.ticks,
+            "time": self.society.clock.now,
+            "observers": len(self._observers),
+            "error": self.error,
+            **self.usage(),
+        }
+
+    def usage(self) -> dict[str, Any]:
+        if self.llm.telemetry is None:
+            return {}
+        summary = self.llm.telemetry.summary()
+        return {"cost": summary.cost, "cost_per_simulated_hour": summary.cost_per_simulated_hour}
+
+    def subscribe(self, maxsize: int = 64) -> Observer:
+        observer = Observer(maxsize)
+        self._observers.add(observer)
+        return observer
+
+    def unsubscribe(self, observer: Observer) -> None:
+        self._observers.discard(observer)
+
+    def publish(self, message: dict[str, Any]) -> None:
+        for observer in self._observers:
+            observer.put(message)
+
+
+class Host(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    llm: LLM
+    concurrency: int = 4
+    evaluation_cache: EvaluationCache | None = Field(default_factory=EvaluationCache)
+    _tenants: dict[str, Tenant] = PrivateAttr(default_factory=dict)
+    _ready: deque[str] = PrivateAttr(default_factory=deque)
+    _wakeup: asyncio.Event = PrivateAttr(default_factory=asyncio.Event)
+    _tasks: set[asyncio.Task] = PrivateAttr(default_factory=set)
+    _scheduler: asyncio.Task | None = PrivateAttr(default=None)
+    _count: int = PrivateAttr(default=0)
+
+    @property
+    def tenants(self) -> dict[str, Tenant]:
+        return self._tenants
+
+    def tenant(self, tenant_id: str) -> Tenant:
+        if tenant_id not in self._tenants:
+            raise KeyError(tenant_id)
+        return self._tenants[tenant_id]
+
+    def start(self) -> Host:
+        if self._scheduler is None:
+            self._scheduler = asyncio.create_task(self._schedule())
+        return self
+
+    async def close(self) -> None:
+        tasks = [task for task in (self._scheduler, *self._tasks) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._scheduler = None
+        for tenant in self._tenants.values():
+            tenant.publish({"type": "closed", "id": tenant.id})
+
+    def _add(self, society: Society) -> Tenant:
+        self._count += 1
+        tenant_id = f"society_{str(self._count).zfill(3)}"
+        # each tenant ends its own ticks, so it needs its own telemetry; host exporters are forked per tenant
+        llm = self.llm if self.llm.telemetry is None else self.llm.instrument(self.llm.telemetry.fork(tenant_id))
+        tenant = Tenant(id=tenant_id, society=society, llm=llm)
+        self._tenants[tenant.id] = tenant
+        return tenant
+
+    def create(
+            self,
+            seed: int | None = None,
+            info_text: str = "",
+            dialogue_turns: int = 0,
+            speculate: bool = False
+    ) -> Tenant:
+        society = Society(
+            evaluation_cache=self.evaluation_cache,
+            dialogue_turns=dialogue_turns,
+            seed=seed,
+            speculate=speculate
+        )
+        society.info_text = info_text
+        return self._add(society)
+
+    def fork(self, tenant_id: str, seed: int | None = None) -> Tenant:
+        tenant = self.tenant(tenant_id)
+        if tenant._stepping:
+            raise RuntimeError(f"`tenant_id`: {tenant_id} is stepping")
+        return self._add(tenant.society.fork(seed))
+
+    def delete(self, tenant_id: str) -> None:
+        tenant = self._tenants.pop(tenant_id)
+        tenant.state = "paused"
+        tenant.publish({"type": "deleted", "id": tenant_id})
+
+    def _enqueue(self, tenant: Tenant) -> None:
+        if tenant.runnable and not tenant._stepping and tenant.id not in self._ready:
+            self._ready.append(tenant.id)
+            self._wakeup.set()
+
+    def step(self, tenant_id: str, ticks: int = 1) -> Tenant:
+        tenant = self.tenant(tenant_id)
+        if tenant.state == "paused":
+            tenant.remaining = 0
+        if tenant.remaining is not None:
+            tenant.remaining += ticks
+        tenant.state = "running"
+        tenant.error = None
+        self._enqueue(tenant)
+        return tenant
+
+    def resume(self, tenant_id: str) -> Tenant:
+        tenant = self.tenant(tenant_id)
+        tenant.state, tenant.remaining, tenant.error = "running", None, None
+        self._enqueue(tenant)
+        return tenant
+
+    def pause(self, tenant_id: str) -> Tenant:
+        tenant = self.tenant(tenant_id)
+        tenant.state, tenant.remaining = "paused", 0
+        return tenant
+
+    async def _schedule(self) -> None:
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            await slots.acquire()
+            tenant = None
+            while tenant is None:
+                while not self._ready:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                tenant = self._tenants.get(self._ready.popleft())
+                if tenant is not None and not tenant.runnable:
+                    tenant = None
+            tenant._stepping = True
+            task = asyncio.create_task(self._tick(tenant))
+            self._tasks.add(task)
+            task.add_done_callback(lambda task, tenant=tenant: self._done(task, tenant, slots))
+
+    def _done(self, task: asyncio.Task, tenant: Tenant, slots: asyncio.Semaphore) -> None:
+        self._tasks.discard(task)
+        slots.release()
+        tenant._stepping = False
+        if tenant.state == "running" and tenant.remaining == 0:
+            tenant.state = "paused"
+        if tenant.id in self._tenants:
+            self._enqueue(tenant)
+
+    async def _tick(self, tenant: Tenant) -> None:
+        society = tenant.society
+        now = society.clock.now
+        try:
+            actions = await society.step_all(tenant.llm)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            tenant.state, tenant.error = "paused", repr(e)
+            logger.print(f"{tenant.id}: {now} で停止 ({tenant.error})")
+            tenant.publish({"type": "error", "id": tenant.id, "tick": now, "error": tenant.error})
+            return
+        tenant.ticks += 1
+        if tenant.remaining is not None:
+            tenant.remaining = max(tenant.remaining - 1, 0)
+        if tenant._observers:
+            store = society.log_store
+            tenant.publish({
+                "type": "tick",
+                "id": tenant.id,
+                "tick": now,
+                "logs": [store.render(action.intern(store), None) for action in actions],
+            })
@@ -0,0 +1,263 @@
+from __future__ import annotations
+import asyncio
+import base64
+import hashlib
+import json
+import re
+from typing import Any
+
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+
+from .host import Host, Tenant
+from utils import logger
+
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11D65"
+REASONS = {
+    200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 426: "Upgrade Required"
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def _frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    size = len(payload)
+    if size < 126:
+        header = bytes([0x80 | opcode, size])
+    elif size < 1 << 16:
+        header = bytes([0x80 | opcode, 126]) + size.to_bytes(2, "big")
+    else:
+        header = bytes([0x80 | opcode, 127]) + size.to_bytes(8, "big")
+    return header + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    first, second = await reader.readexactly(2)
+    size = second & 0x7F
+    if size == 126:
+        size = int.from_bytes(await reader.readexactly(2), "big")
+    elif size == 127:
+        size = int.from_bytes(await reader.readexactly(8), "big")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(size)
+    if mask is not None:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return first & 0x0F, payload
+
+
+class Server(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    host: Host
+    address: str = "127.0.0.1"
+    port: int = 8765
+    queue_size: int = 64
+    max_body: int = 1 << 20
+    _server: asyncio.Server | None = PrivateAttr(default=None)
+    _handlers: dict[asyncio.Task, asyncio.StreamWriter] = PrivateAttr(default_factory=dict)
+
+    @property
+    def bound_port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self) -> Server:
+        self.host.start()
+        self._server = await asyncio.start_server(self._handle, self.address, self.port)
+        logger.print(f"http://{self.address}:{self.bound_port} で待機中")
+        return self
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self, timeout: float = 1.0) -> None:
+        # open streams get `timeout` seconds to flush the closing message before they are dropped
+        if self._server is not None:
+            self._server.close()
+        await self.host.close()
+        if self._handlers:
+            _, pending = await asyncio.wait(self._handlers.keys(), timeout=timeout)
+            for task in pending:
+                self._handlers[task].transport.abort()
+            if pending:
+                await asyncio.wait(pending)
+        if self._server is not None:
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._handlers[task] = writer
+        try:
+            method, path, headers, body = await self._read_request(reader)
+            if path.endswith("/stream") and headers.get("upgrade", "").lower() == "websocket":
+                await self._stream(path, headers, reader, writer)
+                return
+            try:
+                status, payload = self._route(method, path, body)
+            except HTTPError as e:
+                status, payload = e.status, {"error": str(e)}
+            except KeyError as e:
+                status, payload = 404, {"error": f"not found: {e.args[0]}"}
+            except (ValueError, TypeError, RuntimeError) as e:
+                status, payload = 409 if isinstance(e, RuntimeError) else 400, {"error": str(e)}
+            self._respond(writer, status, payload)
+            await writer.drain()
+        except HTTPError as e:
+            self._respond(writer, e.status, {"error": str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._handlers.pop(task, None)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str], Any]:
+        request_line = (await reader.readline()).decode("latin-1").rstrip("\r\n")
+        if not request_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        try:
+            method, path, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, request_line)
+        headers = {}
+        while (line := (await reader.readline()).decode("latin-1").rstrip("\r\n")):
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        size = int(headers.get("content-length", 0))
+        if size > self.max_body:
+            raise HTTPError(413, f"body exceeds {self.max_body} bytes")
+        body = None
+        if size:
+            try:
+                body = json.loads(await reader.readexactly(size))
+            except json.JSONDecodeError as e:
+                raise HTTPError(400, f"invalid JSON: {e}")
+        return method.upper(), path.split("?", 1)[0].rstrip("/") or "/", headers, body
+
+    def _respond(self, writer: asyncio.StreamWriter, status: int, payload: Any) -> None:
+        body = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode()
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+
+    def _route(self, method: str, path: str, body: Any) -> tuple[int, Any]:
+        body = body or {}
+        if not isinstance(body, dict):
+            raise HTTPError(400, "body must be a JSON object")
+        host = self.host
+        if path == "/societies":
+            if method == "GET":
+                return 200, [tenant.status() for tenant in host.tenants.values()]
+            if method == "POST":
+                tenant = host.create(
+                    seed=body.get("seed"),
+                    info_text=str(body.get("info_text", "")),
+                    dialogue_turns=int(body.get("dialogue_turns", 0)),
+                    speculate=bool(body.get("speculate", False))
+                )
+                return 201, tenant.status()
+            raise HTTPError(405, method)
+
+        match = re.fullmatch(r"/societies/([\w-]+)(?:/(step|resume|pause|fork))?", path)
+        if match is None:
+            raise HTTPError(404, path)
+        tenant_id, action = match.groups()
+        if action is None:
+            if method == "GET":
+                return 200, host.tenant(tenant_id).status()
+            if method == "PATCH":
+                tenant = host.tenant(tenant_id)
+                if "info_text" in body:
+                    tenant.society.info_text = str(body["info_text"])
+                return 200, tenant.status()
+            if method == "DELETE":
+                host.delete(tenant_id)
+                return 204, None
+            raise HTTPError(405, method)
+        if method != "POST":
+            raise HTTPError(405, method)
+        if action == "step":
+            ticks = int(body.get("ticks", 1))
+            if ticks < 1:
+                raise ValueError(f"`ticks`: {ticks}")
+            return 200, host.step(tenant_id, ticks).status()
+        if action == "resume":
+            return 200, host.resume(tenant_id).status()
+        if action == "pause":
+            return 200, host.pause(tenant_id).status()
+        return 201, host.fork(tenant_id, body.get("seed")).status()
+
+    async def _stream(
+            self,
+            path: str,
+            headers: dict[str, str],
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter
+    ) -> None:
+        match = re.fullmatch(r"/societies/([\w-]+)/stream", path)
+        tenant: Tenant | None = None if match is None else self.host.tenants.get(match.group(1))
+        if tenant is None:
+            self._respond(writer, 404, {"error": path})
+            return
+        if "sec-websocket-key" not in headers:
+            self._respond(writer, 426, {"error": "Sec-WebSocket-Key is required"})
+            return
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()).digest())
+        writer.write(
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+        )
+        await writer.drain()
+
+        observer = tenant.subscribe(self.queue_size)
+        closed = asyncio.Event()
+
+        async def receive() -> None:
+            try:
+                while True:
+                    opcode, payload = await _read_frame(reader)
+                    if opcode == 0x8:
+                        break
+                    if opcode == 0x9:
+                        writer.write(_frame(payload, 0xA))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                closed.set()
+
+        receiver = asyncio.create_task(receive())
+        try:
+            writer.write(_frame(json.dumps({"type": "status", **tenant.status()}, ensure_ascii=False).encode()))
+            await writer.drain()
+            while not closed.is_set():
+                message = asyncio.create_task(observer.get())
+                done, _ = await asyncio.wait((message, receiver), return_when=asyncio.FIRST_COMPLETED)
+                if message not in done:
+                    message.cancel()
+                    break
+                message = {**message.result(), "dropped": observer.dropped}
+                writer.write(_frame(json.dumps(message, ensure_ascii=False).encode()))
+                await writer.drain()
+                if message["type"] in ("deleted", "closed"):
+                    break
+            writer.write(_frame(b"", 0x8))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            tenant.unsubscribe(observer)
+            receiver.cancel()
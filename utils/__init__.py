@@ -1,7 +1,16 @@
+from typing import Any
+
+
 def load_settings():
     from dotenv import load_dotenv
     from .settings import Settings
     load_dotenv()
     return Settings()
 
-settings = load_settings()
+
+def __getattr__(name: str) -> Any:
+    if name == "settings":
+        global settings
+        settings = load_settings()
+        return settings
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
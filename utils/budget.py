@@ -0,0 +1,107 @@
+from __future__ import annotations
+from typing import Any, Literal
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+
+def _is_cjk(char: str) -> bool:
+    code = ord(char)
+    return (
+        0x3040 <= code <= 0x30FF
+        or 0x3400 <= code <= 0x9FFF
+        or 0xF900 <= code <= 0xFAFF
+        or 0xFF00 <= code <= 0xFFEF
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    cjk = ascii = other = 0
+    for char in text:
+        if char.isascii():
+            ascii += 1
+        elif _is_cjk(char):
+            cjk += 1
+        else:
+            other += 1
+    return int(cjk * 1.1 + ascii / 4 + other / 2) + 1
+
+
+class Section(BaseModel):
+    name: str
+    text: str
+    priority: int = 0
+    keep: Literal["head", "tail"] = "head"
+    minimum: int = 0
+
+
+class Budgeter(BaseModel):
+    limits: dict[str, int] = Field(default_factory=dict)
+    encoding: str | None = None
+    _encoder: Any = PrivateAttr(default=None)
+    _calls: dict[str, int] = PrivateAttr(default_factory=dict)
+    _cuts: dict[str, dict[str, int]] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, context) -> None:
+        if self.encoding is not None:
+            try:
+                import tiktoken
+                self._encoder = tiktoken.get_encoding(self.encoding)
+            except ImportError:
+                self._encoder = None
+
+    @property
+    def cuts(self) -> dict[str, dict[str, int]]:
+        return self._cuts
+
+    def cut_rate(self, site: str, section: str) -> float:
+        calls = self._calls.get(site, 0)
+        return self._cuts.get(site, {}).get(section, 0) / calls if calls else 0.0
+
+    def estimate(self, text: str) -> int:
+        if self._encoder is not None:
+            return len(self._encoder.encode(text))
+        return estimate_tokens(text)
+
+    def truncate(self, text: str, tokens: int, keep: Literal["head", "tail"] = "head") -> str:
+        if self.estimate(text) <= tokens:
+            return text
+        lines = text.split("\n")
+        if keep == "tail":
+            lines.reverse()
+        kept, used = [], 0
+        for line in lines:
+            cost = self.estimate(line)
+            if used + cost > tokens:
+                break
+            kept.append(line)
+            used += cost
+        if not kept and lines:
+            size = int(len(lines[0]) * max(tokens, 0) / max(self.estimate(lines[0]), 1))
+            kept.append(lines[0][:size] if keep == "head" else lines[0][len(lines[0]) - size:])
+        omitted = len(lines) - len(kept)
+        marker = f"…({omitted}行省略)" if omitted else "…"
+        if keep == "tail":
+            kept.reverse()
+            return "\n".join([marker, *kept])
+        return "\n".join([*kept, marker])
+
+    def fit(self, site: str, *sections: Section) -> dict[str, str]:
+        self._calls[site] = self._calls.get(site, 0) + 1
+        texts = {section.name: section.text for section in sections}
+        limit = self.limits.get(site)
+        if limit is None:
+            return texts
+
+        sizes = {section.name: self.estimate(section.text) for section in sections}
+        overflow = sum(sizes.values()) - limit
+        for section in sorted(sections, key=lambda x: x.priority):
+            if overflow <= 0:
+                break
+            cut = min(overflow, sizes[section.name] - section.minimum)
+            if cut <= 0:
+                continue
+            texts[section.name] = self.truncate(section.text, sizes[section.name] - cut, section.keep)
+            overflow -= sizes[section.name] - self.estimate(texts[section.name])
+            cuts = self._cuts.setdefault(site, {})
+            cuts[section.name] = cuts.get(section.name, 0) + 1
+        return texts
@@ -0,0 +1,65 @@
+from __future__ import annotations
+from collections.abc import Callable
+from typing import Any
+
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+
+
+EVENTS = (
+    "on_tick_start",
+    "on_agent_decided",
+    "on_action_evaluated",
+    "on_logs_dispatched",
+    "on_area_updated",
+    "on_tick_end",
+)
+
+
+class Event(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    name: str
+    tick: str
+    start: float
+    end: float
+    data: dict[str, Any]
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+Handler = Callable[[Event], None]
+
+
+class Hooks(BaseModel):
+    _handlers: dict[str, list[Handler]] = PrivateAttr(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self._handlers)
+
+    def active(self, name: str) -> bool:
+        return name in self._handlers
+
+    def on(self, name: str, handler: Handler | None = None) -> Handler | Callable[[Handler], Handler]:
+        if name not in EVENTS:
+            raise ValueError(f"`name`: {name}")
+        if handler is None:
+            return lambda handler: self.on(name, handler)
+        self._handlers.setdefault(name, []).append(handler)
+        return handler
+
+    def off(self, name: str, handler: Handler) -> None:
+        handlers = self._handlers.get(name, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self._handlers.pop(name, None)
+
+    def emit(self, name: str, tick: str, start: float, end: float, **data: Any) -> None:
+        handlers = self._handlers.get(name)
+        if not handlers:
+            return
+        event = Event(name=name, tick=tick, start=start, end=end, data=data)
+        for handler in handlers:
+            handler(event)
@@ -1,3 +1,18 @@
+from typing import Any
+
 from .base import Messages
-from .gemini import Gemini
-from .openai import OpenAI
+from .router import Route, Router, Tier
+from .telemetry import CallRecord, JsonlExporter, MemoryExporter, Price, PrometheusExporter, Telemetry
+
+
+def __getattr__(name: str) -> Any:
+    if name == "Gemini":
+        from .gemini import Gemini
+        return Gemini
+    if name in ("PoolConfig", "Pools", "PoolStats", "pools"):
+        from . import pool
+        return getattr(pool, name)
+    if name == "OpenAI":
+        from .openai import OpenAI
+        return OpenAI
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
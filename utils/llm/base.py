@@ -1,9 +1,12 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from contextlib import AbstractAsyncContextManager, AbstractContextManager, nullcontext
 from typing import Any, Self, TypeVar
 
 from pydantic import BaseModel, PrivateAttr
 
+from .telemetry import CallRecord, Telemetry
+
 
 T = TypeVar("T")
 
@@ -32,11 +35,47 @@ class Messages(BaseModel):
 
 class LLM(BaseModel, ABC):
     _model: str | None = PrivateAttr(default=None)
+    _site: str | None = PrivateAttr(default=None)
+    _telemetry: Telemetry | None = PrivateAttr(default=None)
+    _caps: dict[str, int] = PrivateAttr(default_factory=dict)
+
+    @property
+    def telemetry(self) -> Telemetry | None:
+        return self._telemetry
 
     def model(self, model: str) -> LLM:
         llm = self.model_copy()
         llm._model = model
         return llm
+
+    def site(self, site: str) -> LLM:
+        llm = self.model_copy()
+        llm._site = site
+        return llm
+
+    def instrument(self, telemetry: Telemetry | None) -> LLM:
+        llm = self.model_copy()
+        llm._telemetry = telemetry
+        return llm
+
+    def cap(self, caps: dict[str, int]) -> LLM:
+        llm = self.model_copy()
+        llm._caps = caps
+        return llm
+
+    @property
+    def max_output_tokens(self) -> int | None:
+        return self._caps.get(self._site)
+
+    def _span(self, model: str) -> AbstractContextManager[CallRecord]:
+        if self._telemetry is None:
+            return nullcontext(CallRecord(model=model))
+        return self._telemetry.span(self._site, model)
+
+    def _async_span(self, model: str) -> AbstractAsyncContextManager[CallRecord]:
+        if self._telemetry is None:
+            return nullcontext(CallRecord(model=model))
+        return self._telemetry.async_span(self._site, model)
     
     def _model_check(self, model: str | None) -> str:
         if model:
@@ -64,6 +103,7 @@ class LLM(BaseModel, ABC):
         model: str | None = None,
         prompt: str | None = None,
         messages: str | Messages,
-        strict: T | None = None
+        strict: T | None = None,
+        until_json: bool = False
     ) -> str | T:
         pass
@@ -1,32 +1,58 @@
-from typing import TypeVar
+from __future__ import annotations
+from typing import Any, TypeVar, TYPE_CHECKING
 
-from google.genai import Client
 from pydantic import PrivateAttr, model_validator
 
+import utils
 from .base import LLM, Messages
-from utils import settings
+from .stream import read_json_object
+from utils.budget import estimate_tokens
+
+if TYPE_CHECKING:
+    from google.genai import Client
 
 
 T = TypeVar("T")
 
 
+def _usage(response: Any) -> tuple[int | None, int | None, int | None]:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None, None, None
+    return usage.prompt_token_count, usage.candidates_token_count, usage.cached_content_token_count
+
+
 class Gemini(LLM):
     _client: Client = PrivateAttr()
 
-    def __init__(self, api_key: str = settings.GEMINI_API_KEY) -> None:
+    def __init__(self, api_key: str | None = None, base_url: str | None = None) -> None:
+        if api_key is None:
+            api_key = utils.settings.GEMINI_API_KEY
         if not isinstance(api_key, str):
             raise TypeError(f"`api_key`: {str(api_key)}")
         
+        from google.genai import Client, types
+        from .pool import pools
+
         super().__init__()
-        self._client = Client(api_key=api_key)
+        self._client = Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(
+                base_url=base_url,
+                httpx_client=pools.client("gemini"),
+                httpx_async_client=pools.async_client("gemini")
+            )
+        )
     
     def _create_params(
             self, 
             model: str | None, 
             prompt: str | None, 
             messages: str | Messages
-    ) -> dict[str, str | list[dict[str, str]]]:
+    ) -> dict[str, Any]:
         params = {"model": self._model_check(model), "config": {}}
+        if self.max_output_tokens is not None:
+            params["config"]["max_output_tokens"] = self.max_output_tokens
         
         if isinstance(prompt, str):
             params["config"]["system_instruction"] = prompt
@@ -52,14 +78,17 @@ class Gemini(LLM):
     ) -> str | T:
         
         params = self._create_params(model, prompt, messages)
-        if schema is None:
-            response = self._client.models.generate_content(**params)
-            return response.text
-        elif isinstance(schema, type):
-            params["config"]["response_mime_type"] = "application/json"
-            params["config"]["response_schema"] = schema
-            response = self._client.models.generate_content(**params)
-            return response.parsed
+        with self._span(params["model"]) as call:
+            if schema is None:
+                response = self._client.models.generate_content(**params)
+                call.usage(*_usage(response))
+                return response.text
+            elif isinstance(schema, type):
+                params["config"]["response_mime_type"] = "application/json"
+                params["config"]["response_schema"] = schema
+                response = self._client.models.generate_content(**params)
+                call.usage(*_usage(response))
+                return response.parsed
     
     async def async_generate(
             self, 
@@ -67,15 +96,45 @@ class Gemini(LLM):
             model: str | None = None,
             prompt: str | None = None, 
             messages: str | Messages, 
-            schema: T | None = None
+            schema: T | None = None,
+            until_json: bool = False
     ) -> str | T:
         params = self._create_params(model, prompt, messages)
-        if schema is None:
-            response = await self._client.aio.models.generate_content(**params)
-            return response.text
-        elif isinstance(schema, type):
-            params["config"]["response_mime_type"] = "application/json"
-            params["config"]["response_schema"] = schema
-            response = await self._client.aio.models.generate_content(**params)
-            return response.parsed
-        
\ No newline at end of file
+        async with self._async_span(params["model"]) as call:
+            if schema is None and until_json:
+                return await self._stream_json(params, call)
+            elif schema is None:
+                response = await self._client.aio.models.generate_content(**params)
+                call.usage(*_usage(response))
+                return response.text
+            elif isinstance(schema, type):
+                params["config"]["response_mime_type"] = "application/json"
+                params["config"]["response_schema"] = schema
+                response = await self._client.aio.models.generate_content(**params)
+                call.usage(*_usage(response))
+                return response.parsed
+        
+    async def _stream_json(self, params: dict[str, Any], call: Any) -> str:
+        from .pool import closing_responses
+
+        usage = [None, None, None]
+
+        async def texts():
+            async for chunk in stream:
+                if getattr(chunk, "usage_metadata", None) is not None:
+                    usage[:] = _usage(chunk)
+                if chunk.text:
+                    yield chunk.text
+
+        async with closing_responses():
+            stream = await self._client.aio.models.generate_content_stream(**params)
+            chunks = texts()
+            try:
+                text, stopped = await read_json_object(chunks)
+            finally:
+                await chunks.aclose()
+                await stream.aclose()
+        if stopped:
+            usage[1] = estimate_tokens(text)
+        call.usage(*usage)
+        return text
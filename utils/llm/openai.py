@@ -1,26 +1,48 @@
-from typing import TypeVar
+from __future__ import annotations
+from typing import Any, TypeVar, TYPE_CHECKING
 
-import openai
 from pydantic import PrivateAttr
 
+import utils
 from .base import Messages, LLM
-from utils import settings
+from .stream import read_json_object
+from utils.budget import estimate_tokens
+
+if TYPE_CHECKING:
+    import openai
 
 
 T = TypeVar("T")
 
 
+def _usage(response: Any) -> tuple[int | None, int | None, int | None]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None, None, None
+    details = getattr(usage, "input_tokens_details", None)
+    return usage.input_tokens, usage.output_tokens, getattr(details, "cached_tokens", None)
+
+
 class OpenAI(LLM):
     _client: openai.OpenAI = PrivateAttr()
     _async_client: openai.AsyncOpenAI = PrivateAttr()
 
-    def __init__(self, api_key: str = settings.OPENAI_API_KEY) -> None:
+    def __init__(self, api_key: str | None = None, base_url: str | None = None) -> None:
+        if api_key is None:
+            api_key = utils.settings.OPENAI_API_KEY
         if not isinstance(api_key, str):
             raise TypeError(f"`api_key`: {str(api_key)}")
         
+        import openai
+        from .pool import pools
+
         super().__init__()
-        self._client = openai.OpenAI(api_key=api_key)
-        self._async_client = openai.AsyncOpenAI(api_key=api_key)
+        self._client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=pools.client("openai"))
+        self._async_client = openai.AsyncOpenAI(
+            api_key=api_key, 
+            base_url=base_url, 
+            http_client=pools.async_client("openai")
+        )
 
     def _create_params(
             self, 
@@ -28,8 +50,10 @@ class OpenAI(LLM):
             model: str, 
             prompt: str | None, 
             messages: str | Messages
-    ) -> dict[str, str | list[dict[str, str]]]:
+    ) -> dict[str, Any]:
         params = {"model": self._model_check(model)}
+        if self.max_output_tokens is not None:
+            params["max_output_tokens"] = self.max_output_tokens
         
         if prompt and isinstance(prompt, str):
             params["instructions"] = prompt
@@ -54,13 +78,16 @@ class OpenAI(LLM):
             schema: T | None = None
     ) -> str | T:
         params = self._create_params(model=model, prompt=prompt, messages=messages)
-        if schema is None:
-            response = self._client.responses.create(**params)
-            return response.output_text
-        else:
-            params["text_format"] = schema
-            response = self._client.responses.parse(**params)
-            return response.output_parsed
+        with self._span(params["model"]) as call:
+            if schema is None:
+                response = self._client.responses.create(**params)
+                call.usage(*_usage(response))
+                return response.output_text
+            else:
+                params["text_format"] = schema
+                response = self._client.responses.parse(**params)
+                call.usage(*_usage(response))
+                return response.output_parsed
     
     async def async_generate(
             self,
@@ -68,13 +95,43 @@ class OpenAI(LLM):
             model: str | None = None,
             prompt: str | None = None,
             messages: str | Messages,
-            schema: T | None = None
+            schema: T | None = None,
+            until_json: bool = False
     ) -> str | T:
         params = self._create_params(model=model, prompt=prompt, messages=messages)
-        if schema is None:
-            response = await self._async_client.responses.create(**params)
-            return response.output_text
-        else:
-            params["text_format"] = schema
-            response = await self._async_client.responses.parse(**params)
-            return response.output_parsed
+        async with self._async_span(params["model"]) as call:
+            if schema is None and until_json:
+                return await self._stream_json(params, call)
+            elif schema is None:
+                response = await self._async_client.responses.create(**params)
+                call.usage(*_usage(response))
+                return response.output_text
+            else:
+                params["text_format"] = schema
+                response = await self._async_client.responses.parse(**params)
+                call.usage(*_usage(response))
+                return response.output_parsed
+
+    async def _stream_json(self, params: dict[str, Any], call: Any) -> str:
+        stream = await self._async_client.responses.create(**params, stream=True)
+        usage = [None, None, None]
+
+        async def deltas():
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield event.delta
+                elif event.type in ("response.completed", "response.incomplete"):
+                    usage[:] = _usage(event.response)
+
+        chunks = deltas()
+        try:
+            text, stopped = await read_json_object(chunks)
+        finally:
+            await chunks.aclose()
+            await stream.close()
+        if stopped:
+            if usage[0] is None:
+                usage[0] = estimate_tokens(f"{params.get('instructions', '')}{params['input']}")
+            usage[1] = estimate_tokens(text)
+        call.usage(*usage)
+        return text
@@ -0,0 +1,307 @@
+from __future__ import annotations
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import importlib.util
+import threading
+from typing import Any
+import weakref
+
+import httpx
+from pydantic import BaseModel, PrivateAttr
+
+
+class PoolConfig(BaseModel):
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = True
+    timeout: float = 600.0
+    connect_timeout: float = 5.0
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+    @property
+    def timeouts(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    @property
+    def use_http2(self) -> bool:
+        return self.http2 and importlib.util.find_spec("h2") is not None
+
+
+class PoolStats(BaseModel):
+    provider: str
+    http2: bool
+    max_connections: int
+    requests: int = 0
+    errors: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    connections: int = 0
+    idle_connections: int = 0
+
+    @property
+    def busy_connections(self) -> int:
+        return self.connections - self.idle_connections
+
+    @property
+    def waiting(self) -> int:
+        return max(self.in_flight - self.busy_connections, 0)
+
+    @property
+    def utilisation(self) -> float:
+        return self.busy_connections / self.max_connections if self.max_connections else 0.0
+
+    @property
+    def saturated(self) -> bool:
+        return self.peak_in_flight > self.max_connections
+
+
+class _Counter:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def enter(self) -> None:
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def exit(self, error: bool) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            self.errors += error
+
+
+_opened: ContextVar[list[_AsyncStream] | None] = ContextVar("_opened", default=None)
+
+
+# closes response bodies the SDK left unread, instead of waiting for garbage collection to release them
+@asynccontextmanager
+async def closing_responses() -> AsyncIterator[None]:
+    streams: list[_AsyncStream] = []
+    token = _opened.set(streams)
+    try:
+        yield
+    finally:
+        _opened.reset(token)
+        for stream in streams:
+            await stream.aclose()
+
+
+class _SyncStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, counter: _Counter) -> None:
+        self._stream = stream
+        self._counter = counter
+        self._closed = False
+
+    def __iter__(self) -> Any:
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._counter.exit(False)
+
+
+class _AsyncStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, counter: _Counter) -> None:
+        self._stream = stream
+        self._counter = counter
+        self._closed = False
+
+    async def __aiter__(self) -> Any:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._stream.aclose()
+        finally:
+            self._counter.exit(False)
+
+
+# a request is in flight from send until its response body is closed
+class _CountingTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.HTTPTransport, counter: _Counter) -> None:
+        self.transport = transport
+        self._counter = counter
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self._counter.enter()
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            self._counter.exit(True)
+            raise
+        response.stream = _SyncStream(response.stream, self._counter)
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+# async connections belong to the event loop that opened them, so each running loop gets its own pool
+class _AsyncCountingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, config: PoolConfig, counter: _Counter) -> None:
+        self._config = config
+        self._counter = counter
+        self._transports: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    @property
+    def transports(self) -> list[httpx.AsyncHTTPTransport]:
+        return [transport for loop, transport in self._transports.items() if not loop.is_closed()]
+
+    @property
+    def transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        for closed in [other for other in self._transports.keys() if other.is_closed()]:
+            del self._transports[closed]
+        if loop not in self._transports:
+            self._transports[loop] = httpx.AsyncHTTPTransport(
+                limits=self._config.limits, http2=self._config.use_http2
+            )
+        return self._transports[loop]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._counter.enter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self._counter.exit(True)
+            raise
+        response.stream = _AsyncStream(response.stream, self._counter)
+        if (opened := _opened.get()) is not None:
+            opened.append(response.stream)
+        return response
+
+    async def aclose(self) -> None:
+        loop = asyncio.get_running_loop()
+        transport = self._transports.pop(loop, None)
+        self._transports.clear()
+        if transport is not None:
+            await transport.aclose()
+
+
+def _connections(transport: httpx.HTTPTransport | httpx.AsyncHTTPTransport | None) -> tuple[int, int]:
+    connections = getattr(getattr(transport, "_pool", None), "connections", [])
+    return len(connections), sum(1 for connection in connections if connection.is_idle())
+
+
+class Pools(BaseModel):
+    configs: dict[str, PoolConfig] = {}
+    _clients: dict[str, httpx.Client] = PrivateAttr(default_factory=dict)
+    _async_clients: dict[str, httpx.AsyncClient] = PrivateAttr(default_factory=dict)
+    _counters: dict[str, _Counter] = PrivateAttr(default_factory=dict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def config(self, provider: str) -> PoolConfig:
+        return self.configs.get(provider) or PoolConfig()
+
+    def configure(self, provider: str, config: PoolConfig | None = None, **kwargs: Any) -> PoolConfig:
+        if provider in self._clients or provider in self._async_clients:
+            raise RuntimeError(f"`provider`: {provider} pool is already in use")
+        config = (config or self.config(provider)).model_copy(update=kwargs)
+        self.configs[provider] = config
+        return config
+
+    def _counter(self, provider: str) -> _Counter:
+        if provider not in self._counters:
+            self._counters[provider] = _Counter()
+        return self._counters[provider]
+
+    def client(self, provider: str) -> httpx.Client:
+        with self._lock:
+            if provider not in self._clients:
+                config = self.config(provider)
+                transport = httpx.HTTPTransport(limits=config.limits, http2=config.use_http2)
+                self._clients[provider] = httpx.Client(
+                    transport=_CountingTransport(transport, self._counter(provider)),
+                    timeout=config.timeouts,
+                    follow_redirects=True
+                )
+            return self._clients[provider]
+
+    def async_client(self, provider: str) -> httpx.AsyncClient:
+        with self._lock:
+            if provider not in self._async_clients:
+                config = self.config(provider)
+                self._async_clients[provider] = httpx.AsyncClient(
+                    transport=_AsyncCountingTransport(config, self._counter(provider)),
+                    timeout=config.timeouts,
+                    follow_redirects=True
+                )
+            return self._async_clients[provider]
+
+    def stats(self) -> dict[str, PoolStats]:
+        stats = {}
+        for provider in sorted(set(self._clients) | set(self._async_clients)):
+            config = self.config(provider)
+            counter = self._counter(provider)
+            transports = []
+            if (client := self._clients.get(provider)) is not None:
+                transports.append(client._transport.transport)
+            if (client := self._async_clients.get(provider)) is not None:
+                transports.extend(client._transport.transports)
+            connections = [_connections(transport) for transport in transports]
+            stats[provider] = PoolStats(
+                provider=provider,
+                http2=config.use_http2,
+                max_connections=config.max_connections,
+                requests=counter.requests,
+                errors=counter.errors,
+                in_flight=counter.in_flight,
+                peak_in_flight=counter.peak_in_flight,
+                connections=sum(total for total, _ in connections),
+                idle_connections=sum(idle for _, idle in connections)
+            )
+        return stats
+
+    def prometheus(self) -> str:
+        lines = []
+        for provider, stats in self.stats().items():
+            label = f'provider="{provider}"'
+            lines.append(f"llm_pool_requests_total{{{label}}} {stats.requests}")
+            lines.append(f"llm_pool_errors_total{{{label}}} {stats.errors}")
+            lines.append(f"llm_pool_in_flight{{{label}}} {stats.in_flight}")
+            lines.append(f"llm_pool_peak_in_flight{{{label}}} {stats.peak_in_flight}")
+            lines.append(f"llm_pool_connections{{{label}}} {stats.connections}")
+            lines.append(f"llm_pool_idle_connections{{{label}}} {stats.idle_connections}")
+            lines.append(f"llm_pool_waiting{{{label}}} {stats.waiting}")
+            lines.append(f"llm_pool_utilisation{{{label}}} {stats.utilisation}")
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        for client in self._clients.values():
+            client.close()
+        self._clients.clear()
+
+    async def aclose(self) -> None:
+        self.close()
+        for client in self._async_clients.values():
+            await client.aclose()
+        self._async_clients.clear()
+        self._counters.clear()
+
+
+pools = Pools()
@@ -0,0 +1,164 @@
+from __future__ import annotations
+import time
+from typing import Any, TypeVar
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+from .base import LLM, Messages
+from .telemetry import Telemetry
+from utils.functions import parse_json
+
+
+T = TypeVar("T")
+
+
+class Tier(BaseModel):
+    llm: LLM
+    cost_per_call: float = 0.0
+
+
+class Route(BaseModel):
+    tiers: list[str]
+    json_output: bool = False
+    min_confidence: float | None = None
+
+
+class TierStats(BaseModel):
+    calls: int = 0
+    escalations: int = 0
+    errors: int = 0
+    latency: float = 0.0
+    cost: float = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.latency / self.calls if self.calls else 0.0
+
+
+class Router(LLM):
+    tiers: dict[str, Tier]
+    routes: dict[str, Route] = Field(default_factory=dict)
+    default: Route
+    _stats: dict[str, TierStats] = PrivateAttr(default_factory=dict)
+
+    @property
+    def stats(self) -> dict[str, TierStats]:
+        return self._stats
+
+    @property
+    def route(self) -> Route:
+        return self.routes.get(self._site, self.default)
+
+    def instrument(self, telemetry: Telemetry | None) -> Router:
+        llm = super().instrument(telemetry)
+        llm.tiers = {
+            name: tier.model_copy(update={"llm": tier.llm.instrument(telemetry)})
+            for name, tier in self.tiers.items()
+        }
+        return llm
+
+    def cap(self, caps: dict[str, int]) -> Router:
+        llm = super().cap(caps)
+        llm.tiers = {
+            name: tier.model_copy(update={"llm": tier.llm.cap(caps)})
+            for name, tier in self.tiers.items()
+        }
+        return llm
+
+    def _tier(self, name: str) -> tuple[LLM, TierStats]:
+        llm = self.tiers[name].llm
+        if self._site is not None:
+            llm = llm.site(self._site)
+        return llm, self._stats.setdefault(name, TierStats())
+
+    def _confidence(self, result: Any) -> float | None:
+        if isinstance(result, str):
+            try:
+                result = parse_json(result)
+            except ValueError:
+                return None
+        if isinstance(result, dict):
+            value = result.get("confidence")
+        else:
+            value = getattr(result, "confidence", None)
+        try:
+            return None if value is None else float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _accept(self, route: Route, result: Any) -> bool:
+        if result is None:
+            return False
+        if route.json_output and isinstance(result, str):
+            try:
+                if parse_json(result) is None:
+                    return False
+            except ValueError:
+                return False
+        if route.min_confidence is not None:
+            confidence = self._confidence(result)
+            if confidence is not None and confidence < route.min_confidence:
+                return False
+        return True
+
+    def _record(self, name: str, stats: TierStats, start: float, error: bool) -> None:
+        stats.calls += 1
+        stats.latency += time.perf_counter() - start
+        stats.cost += self.tiers[name].cost_per_call
+        if error:
+            stats.errors += 1
+
+    def generate(
+            self,
+            *,
+            model: str | None = None,
+            prompt: str | None = None,
+            messages: str | Messages,
+            schema: type | None = None
+    ) -> str | T:
+        route = self.route
+        result, error = None, None
+        for i, name in enumerate(route.tiers):
+            llm, stats = self._tier(name)
+            start = time.perf_counter()
+            try:
+                result, error = llm.generate(prompt=prompt, messages=messages, schema=schema), None
+            except Exception as e:
+                result, error = None, e
+            self._record(name, stats, start, error is not None)
+            if self._accept(route, result):
+                return result
+            if i < len(route.tiers) - 1:
+                stats.escalations += 1
+        if error is not None:
+            raise error
+        return result
+
+    async def async_generate(
+            self,
+            *,
+            model: str | None = None,
+            prompt: str | None = None,
+            messages: str | Messages,
+            schema: type | None = None,
+            until_json: bool = False
+    ) -> str | T:
+        route = self.route
+        result, error = None, None
+        for i, name in enumerate(route.tiers):
+            llm, stats = self._tier(name)
+            start = time.perf_counter()
+            try:
+                result, error = await llm.async_generate(
+                    prompt=prompt, messages=messages, schema=schema, until_json=until_json
+                ), None
+            except Exception as e:
+                result, error = None, e
+            self._record(name, stats, start, error is not None)
+            if self._accept(route, result):
+                return result
+            if i < len(route.tiers) - 1:
+                stats.escalations += 1
+        if error is not None:
+            raise error
+        return result
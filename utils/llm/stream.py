@@ -0,0 +1,53 @@
+from __future__ import annotations
+from collections.abc import AsyncIterator
+
+
+# braces inside strings are ignored and anything before the opening brace (prose, code fences) is skipped
+class JsonObjectReader:
+    __slots__ = ("_parts", "_depth", "_string", "_escape", "result")
+
+    def __init__(self) -> None:
+        self._parts: list[str] = []
+        self._depth = 0
+        self._string = False
+        self._escape = False
+        self.result: str | None = None
+
+    def feed(self, chunk: str) -> str | None:
+        if self.result is not None:
+            return self.result
+        start = 0
+        for i, char in enumerate(chunk):
+            if self._depth == 0:
+                if char == "{":
+                    start, self._depth = i, 1
+            elif self._string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._string = False
+            elif char == '"':
+                self._string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(chunk[start:i + 1])
+                    self.result = "".join(self._parts)
+                    return self.result
+        if self._depth > 0:
+            self._parts.append(chunk[start:])
+        return None
+
+
+async def read_json_object(chunks: AsyncIterator[str]) -> tuple[str, bool]:
+    reader = JsonObjectReader()
+    text = []
+    async for chunk in chunks:
+        text.append(chunk)
+        if reader.feed(chunk) is not None:
+            return reader.result, True
+    return "".join(text), False
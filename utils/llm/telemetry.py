@@ -0,0 +1,376 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from collections.abc import AsyncIterator, Iterator
+import json
+import math
+import os
+import random
+import time
+from typing import Any
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+from utils import time as timeutils
+
+
+class Price(BaseModel):
+    input: float
+    output: float
+    cached: float | None = None
+
+    def cost(self, record: CallRecord) -> float:
+        cached = self.input if self.cached is None else self.cached
+        uncached = max(record.input_tokens - record.cached_tokens, 0)
+        return (
+            uncached * self.input 
+            + record.cached_tokens * cached 
+            + record.output_tokens * self.output
+        ) / 1_000_000
+
+
+class CallRecord(BaseModel):
+    site: str | None = None
+    model: str
+    tick: str | None = None
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    queue_wait: float = 0.0
+    latency: float = 0.0
+    cost: float = 0.0
+    error: bool = False
+
+    def usage(self, input_tokens: int | None, output_tokens: int | None, cached_tokens: int | None) -> None:
+        self.input_tokens = input_tokens or 0
+        self.output_tokens = output_tokens or 0
+        self.cached_tokens = cached_tokens or 0
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(math.ceil(q * len(values)) - 1, 0)
+    return values[index]
+
+
+class Histogram(BaseModel):
+    count: int
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+
+    @classmethod
+    def of(cls, values: list[float]) -> Histogram:
+        return cls(
+            count=len(values),
+            mean=sum(values) / len(values) if values else 0.0,
+            p50=percentile(values, 0.50),
+            p95=percentile(values, 0.95),
+            p99=percentile(values, 0.99)
+        )
+
+
+class Reservoir(BaseModel):
+    size: int = 1024
+    count: int = 0
+    total: float = 0.0
+    values: list[float] = Field(default_factory=list)
+    _rng: random.Random = PrivateAttr(default_factory=lambda: random.Random(0))
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if len(self.values) < self.size:
+            self.values.append(value)
+        elif (index := self._rng.randrange(self.count)) < self.size:
+            self.values[index] = value
+
+    def histogram(self) -> Histogram:
+        return Histogram(
+            count=self.count,
+            mean=self.total / self.count if self.count else 0.0,
+            p50=percentile(self.values, 0.50),
+            p95=percentile(self.values, 0.95),
+            p99=percentile(self.values, 0.99)
+        )
+
+
+class SiteTotals(BaseModel):
+    calls: int = 0
+    errors: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    cost: float = 0.0
+    latency: Reservoir = Field(default_factory=Reservoir)
+    queue_wait: Reservoir = Field(default_factory=Reservoir)
+
+    def add(self, record: CallRecord) -> None:
+        self.calls += 1
+        self.errors += record.error
+        self.input_tokens += record.input_tokens
+        self.output_tokens += record.output_tokens
+        self.cached_tokens += record.cached_tokens
+        self.cost += record.cost
+        self.latency.add(record.latency)
+        self.queue_wait.add(record.queue_wait)
+
+    def summary(self) -> SiteSummary:
+        return SiteSummary(
+            calls=self.calls,
+            errors=self.errors,
+            input_tokens=self.input_tokens,
+            output_tokens=self.output_tokens,
+            cached_tokens=self.cached_tokens,
+            cost=self.cost,
+            latency=self.latency.histogram(),
+            queue_wait=self.queue_wait.histogram()
+        )
+
+
+class SiteSummary(BaseModel):
+    calls: int
+    errors: int
+    input_tokens: int
+    output_tokens: int
+    cached_tokens: int
+    cost: float
+    latency: Histogram
+    queue_wait: Histogram
+
+    @classmethod
+    def of(cls, records: list[CallRecord]) -> SiteSummary:
+        return cls(
+            calls=len(records),
+            errors=sum(r.error for r in records),
+            input_tokens=sum(r.input_tokens for r in records),
+            output_tokens=sum(r.output_tokens for r in records),
+            cached_tokens=sum(r.cached_tokens for r in records),
+            cost=sum(r.cost for r in records),
+            latency=Histogram.of([r.latency for r in records]),
+            queue_wait=Histogram.of([r.queue_wait for r in records])
+        )
+
+
+class Summary(BaseModel):
+    label: str
+    tenant: str | None = None
+    ticks: int
+    cost: float
+    cost_per_simulated_hour: float
+    sites: dict[str, SiteSummary]
+
+    @classmethod
+    def build(cls, label: str, sites: dict[str, SiteSummary], ticks: int, tenant: str | None = None) -> Summary:
+        cost = sum(site.cost for site in sites.values())
+        hours = ticks / timeutils.calc(hour=1)
+        return cls(
+            label=label,
+            tenant=tenant,
+            ticks=ticks,
+            cost=cost,
+            cost_per_simulated_hour=cost / hours if hours else 0.0,
+            sites=sites
+        )
+
+    @classmethod
+    def of(cls, label: str, records: list[CallRecord], ticks: int, tenant: str | None = None) -> Summary:
+        sites: dict[str, list[CallRecord]] = {}
+        for record in records:
+            sites.setdefault(record.site or "unknown", []).append(record)
+        return cls.build(label, {site: SiteSummary.of(r) for site, r in sites.items()}, ticks, tenant)
+
+
+class Exporter(ABC):
+    def record(self, record: CallRecord) -> None:
+        pass
+
+    @abstractmethod
+    def export(self, tick: Summary, run: Summary) -> None:
+        pass
+
+    def fork(self, tenant: str) -> Exporter:
+        return self
+
+
+class MemoryExporter(Exporter):
+    def __init__(self) -> None:
+        self.records: list[CallRecord] = []
+        self.ticks: list[Summary] = []
+        self.run: Summary | None = None
+        self.tenants: dict[str, MemoryExporter] = {}
+
+    def record(self, record: CallRecord) -> None:
+        self.records.append(record)
+
+    def export(self, tick: Summary, run: Summary) -> None:
+        self.ticks.append(tick)
+        self.run = run
+
+    def fork(self, tenant: str) -> MemoryExporter:
+        # tenant ticks land in this exporter's lists too; each tenant's run summary stays in tenants
+        exporter = MemoryExporter()
+        exporter.records, exporter.ticks = self.records, self.ticks
+        self.tenants[tenant] = exporter
+        return exporter
+
+
+class JsonlExporter(Exporter):
+    def __init__(self, filepath: str, calls: bool = False, tenant: str | None = None) -> None:
+        self.filepath = filepath
+        self.calls = calls
+        self.tenant = tenant
+
+    def _write(self, kind: str, data: dict[str, Any]) -> None:
+        if self.tenant is not None:
+            data = {"tenant": self.tenant, **data}
+        with open(self.filepath, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"kind": kind, **data}, ensure_ascii=False) + "\n")
+
+    def record(self, record: CallRecord) -> None:
+        if self.calls:
+            self._write("call", record.model_dump())
+
+    def export(self, tick: Summary, run: Summary) -> None:
+        self._write("tick", tick.model_dump())
+
+    def fork(self, tenant: str) -> JsonlExporter:
+        return JsonlExporter(self.filepath, self.calls, tenant)
+
+
+class PrometheusExporter(Exporter):
+    def __init__(self, filepath: str, prefix: str = "ai_agend_llm") -> None:
+        self.filepath = filepath
+        self.prefix = prefix
+
+    def fork(self, tenant: str) -> PrometheusExporter:
+        # the file is rewritten on every export, so each tenant gets its own
+        root, ext = os.path.splitext(self.filepath)
+        return PrometheusExporter(f"{root}.{tenant}{ext}", self.prefix)
+
+    def export(self, tick: Summary, run: Summary) -> None:
+        p = self.prefix
+        lines = [
+            f"# TYPE {p}_latency_seconds summary",
+            f"# TYPE {p}_queue_wait_seconds summary",
+            f"# TYPE {p}_tokens_total counter",
+            f"# TYPE {p}_cost_total counter",
+        ]
+        for site, summary in run.sites.items():
+            for name, histogram in (("latency", summary.latency), ("queue_wait", summary.queue_wait)):
+                for q in ("p50", "p95", "p99"):
+                    quantile = int(q[1:]) / 100
+                    lines.append(f'{p}_{name}_seconds{{site="{site}",quantile="{quantile}"}} {getattr(histogram, q)}')
+                lines.append(f'{p}_{name}_seconds_count{{site="{site}"}} {histogram.count}')
+            for kind in ("input", "output", "cached"):
+                lines.append(f'{p}_tokens_total{{site="{site}",kind="{kind}"}} {getattr(summary, f"{kind}_tokens")}')
+            lines.append(f'{p}_calls_total{{site="{site}"}} {summary.calls}')
+            lines.append(f'{p}_errors_total{{site="{site}"}} {summary.errors}')
+            lines.append(f'{p}_cost_total{{site="{site}"}} {summary.cost}')
+        lines.append(f"{p}_ticks_total {run.ticks}")
+        lines.append(f"{p}_cost_per_simulated_hour {run.cost_per_simulated_hour}")
+
+        tmp = f"{self.filepath}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.filepath)
+
+
+class Telemetry(BaseModel):
+    prices: dict[str, Price] = Field(default_factory=dict)
+    exporters: list[Any] = Field(default_factory=list)
+    concurrency: int | None = None
+    reservoir: int = 1024
+    tenant: str | None = None
+    _totals: dict[str, SiteTotals] = PrivateAttr(default_factory=dict)
+    _tick_records: list[CallRecord] = PrivateAttr(default_factory=list)
+    _ticks: int = PrivateAttr(default=0)
+    _semaphore: asyncio.Semaphore | None = PrivateAttr(default=None)
+
+    def model_post_init(self, context) -> None:
+        if self.concurrency is not None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    @property
+    def records(self) -> list[CallRecord]:
+        return self._tick_records
+
+    def fork(self, tenant: str) -> Telemetry:
+        # separate totals and tick count under the same prices and concurrency limit
+        telemetry = Telemetry(
+            prices=self.prices,
+            exporters=[exporter.fork(tenant) for exporter in self.exporters],
+            reservoir=self.reservoir,
+            tenant=tenant
+        )
+        telemetry.concurrency, telemetry._semaphore = self.concurrency, self._semaphore
+        return telemetry
+
+    def _finish(self, record: CallRecord) -> None:
+        if (price := self.prices.get(record.model)) is not None:
+            record.cost = price.cost(record)
+        self._tick_records.append(record)
+        for exporter in self.exporters:
+            exporter.record(record)
+
+    @contextmanager
+    def span(self, site: str | None, model: str) -> Iterator[CallRecord]:
+        record = CallRecord(site=site, model=model)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record.error = True
+            raise
+        finally:
+            record.latency = time.perf_counter() - start
+            self._finish(record)
+
+    @asynccontextmanager
+    async def async_span(self, site: str | None, model: str) -> AsyncIterator[CallRecord]:
+        record = CallRecord(site=site, model=model)
+        queued = time.perf_counter()
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+        start = time.perf_counter()
+        record.queue_wait = start - queued
+        try:
+            yield record
+        except BaseException:
+            record.error = True
+            raise
+        finally:
+            record.latency = time.perf_counter() - start
+            if self._semaphore is not None:
+                self._semaphore.release()
+            self._finish(record)
+
+    def end_tick(self, label: str) -> Summary:
+        for record in self._tick_records:
+            record.tick = label
+            site = record.site or "unknown"
+            if site not in self._totals:
+                self._totals[site] = SiteTotals(
+                    latency=Reservoir(size=self.reservoir), queue_wait=Reservoir(size=self.reservoir)
+                )
+            self._totals[site].add(record)
+        self._ticks += 1
+        tick = Summary.of(label, self._tick_records, 1, self.tenant)
+        run = self.summary()
+        for exporter in self.exporters:
+            exporter.export(tick, run)
+        self._tick_records = []
+        return tick
+
+    def summary(self) -> Summary:
+        return Summary.build(
+            "run", {site: totals.summary() for site, totals in self._totals.items()}, self._ticks, self.tenant
+        )
+
+    @property
+    def cost_per_simulated_hour(self) -> float:
+        return self.summary().cost_per_simulated_hour
@@ -0,0 +1,78 @@
+from __future__ import annotations
+from collections.abc import Callable, Iterator
+import hashlib
+import json
+import os
+import pickle
+import re
+from typing import Any, TypeVar
+
+
+T = TypeVar("T")
+
+CACHE_VERSION = 1
+
+_SKIP = re.compile(r"[\s,]*")
+
+
+def file_hash(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_json_records(filepath: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    if filepath.endswith(".jsonl"):
+        with open(filepath, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    decoder = json.JSONDecoder()
+    with open(filepath, encoding="utf-8") as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"`filepath`: {filepath} is not a JSON array")
+        pos, eof = 1, False
+        while True:
+            pos = _SKIP.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                # a scalar that ends with the buffer may continue in the next chunk
+                if end == len(buffer) and not eof:
+                    raise json.JSONDecodeError("record reaches the end of the buffer", buffer, end)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            pos = end
+            yield record
+
+
+def cached(filepath: str, kind: str, build: Callable[[], T], cache_dir: str | None) -> T:
+    if cache_dir is None:
+        return build()
+
+    name = f"{os.path.basename(filepath)}.{kind}.v{CACHE_VERSION}.{file_hash(filepath)[:16]}.pickle"
+    path = os.path.join(cache_dir, name)
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    value = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    return value
@@ -0,0 +1,155 @@
+from __future__ import annotations
+import os
+import tracemalloc
+
+from pydantic import BaseModel, PrivateAttr
+
+from .hooks import Event, Hooks
+
+
+SUBSYSTEMS: tuple[tuple[str, tuple[str, ...]], ...] = (
+    ("llm", (
+        f"utils{os.sep}llm{os.sep}", f"{os.sep}openai{os.sep}", f"{os.sep}genai{os.sep}",
+        f"{os.sep}httpx{os.sep}", f"{os.sep}httpcore{os.sep}", f"{os.sep}h11{os.sep}", f"{os.sep}ssl.py"
+    )),
+    ("actions", (f"models{os.sep}action.py",)),
+    ("agent_logs", (f"models{os.sep}agent.py",)),
+    ("area_logs", (f"models{os.sep}area.py",)),
+    ("log_store", (f"models{os.sep}log.py",)),
+    ("society", (f"models{os.sep}society.py", f"models{os.sep}shard.py")),
+)
+
+
+def subsystem(traceback: tracemalloc.Traceback) -> str:
+    # the innermost subsystem frame wins, but log.py allocations go to the agent or area that appended them
+    found = None
+    for frame in reversed(traceback):
+        for name, patterns in SUBSYSTEMS:
+            if any(pattern in frame.filename for pattern in patterns):
+                break
+        else:
+            continue
+        if found is None:
+            found = name
+            if name != "log_store":
+                return name
+        elif name in ("agent_logs", "area_logs"):
+            return name
+    return found or "other"
+
+
+class MemorySample(BaseModel):
+    tick: str
+    ticks: int
+    current: int
+    peak: int
+    subsystems: dict[str, int]
+    growth: dict[str, int]
+    bytes_per_tick: float
+    top: list[tuple[str, int]]
+
+
+class MemoryProfiler(BaseModel):
+    every: int = 10
+    frames: int = 16
+    warmup: int = 1
+    top: int = 5
+    max_bytes_per_tick: float | None = None
+    filepath: str | None = None
+    _samples: list[MemorySample] = PrivateAttr(default_factory=list)
+    _ticks: int = PrivateAttr(default=0)
+    _previous: dict[str, int] = PrivateAttr(default_factory=dict)
+    _started: bool = PrivateAttr(default=False)
+
+    @property
+    def samples(self) -> list[MemorySample]:
+        return self._samples
+
+    @property
+    def bytes_per_tick(self) -> float:
+        # warm-up samples absorb caches and pools, so the slope starts after them
+        samples = self._samples[self.warmup:]
+        if len(samples) < 2:
+            return 0.0
+        first, last = samples[0], samples[-1]
+        return (last.current - first.current) / max(last.ticks - first.ticks, 1)
+
+    def start(self) -> MemoryProfiler:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started = True
+        return self
+
+    def stop(self) -> None:
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def attach(self, hooks: Hooks) -> MemoryProfiler:
+        self.start()
+        hooks.on("on_tick_end", self.handle)
+        return self
+
+    def detach(self, hooks: Hooks) -> None:
+        hooks.off("on_tick_end", self.handle)
+        self.stop()
+
+    def handle(self, event: Event) -> None:
+        self._ticks += 1
+        if self._ticks % self.every == 0:
+            self.sample(event.tick)
+
+    def sample(self, tick: str) -> MemorySample:
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        subsystems: dict[str, int] = {}
+        for stat in snapshot.statistics("traceback"):
+            name = subsystem(stat.traceback)
+            subsystems[name] = subsystems.get(name, 0) + stat.size
+        current, peak = tracemalloc.get_traced_memory()
+
+        previous = self._samples[-1] if self._samples else None
+        growth = {
+            name: subsystems.get(name, 0) - self._previous.get(name, 0) for name in subsystems.keys() | self._previous.keys()
+        }
+        lines = snapshot.statistics("lineno")
+        sample = MemorySample(
+            tick=tick,
+            ticks=self._ticks,
+            current=current,
+            peak=peak,
+            subsystems=subsystems,
+            growth=growth,
+            bytes_per_tick=(current - previous.current) / max(self._ticks - previous.ticks, 1) if previous else 0.0,
+            top=[(str(stat.traceback[0]), stat.size) for stat in lines[:self.top]]
+        )
+        self._previous = subsystems
+        self._samples.append(sample)
+        if self.filepath is not None:
+            with open(self.filepath, "a", encoding="utf-8") as f:
+                f.write(sample.model_dump_json() + "\n")
+        return sample
+
+    def check(self) -> None:
+        if self.max_bytes_per_tick is None:
+            return
+        if (rate := self.bytes_per_tick) > self.max_bytes_per_tick:
+            growth: dict[str, int] = {}
+            for sample in self._samples[self.warmup + 1:]:
+                for name, size in sample.growth.items():
+                    growth[name] = growth.get(name, 0) + size
+            culprits = ", ".join(f"{name}={size}" for name, size in sorted(growth.items(), key=lambda x: -x[1])[:3])
+            raise RuntimeError(f"memory grows {rate:.0f} bytes/tick (limit {self.max_bytes_per_tick:.0f}): {culprits}")
+
+    def summary(self) -> str:
+        lines = [f"{'tick':<16}{'current':>12}{'bytes/tick':>12}  top growth"]
+        for sample in self._samples:
+            top = sorted(sample.growth.items(), key=lambda x: -x[1])[:3]
+            lines.append(
+                f"{sample.tick:<16}{sample.current:>12}{sample.bytes_per_tick:>12.0f}  "
+                + ", ".join(f"{name}={size:+d}" for name, size in top)
+            )
+        return "\n".join(lines)
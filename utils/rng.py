@@ -0,0 +1,26 @@
+from __future__ import annotations
+import hashlib
+import random
+import secrets
+
+from pydantic import BaseModel
+
+
+class Seed(BaseModel):
+    entropy: int
+    path: tuple[str | int, ...] = ()
+
+    @classmethod
+    def create(cls, entropy: int | None = None) -> Seed:
+        return cls(entropy=secrets.randbits(64) if entropy is None else entropy)
+
+    def spawn(self, *keys: str | int) -> Seed:
+        return Seed(entropy=self.entropy, path=(*self.path, *keys))
+
+    @property
+    def state(self) -> int:
+        digest = hashlib.blake2b(repr((self.entropy, self.path)).encode(), digest_size=16).digest()
+        return int.from_bytes(digest, "little")
+
+    def random(self) -> random.Random:
+        return random.Random(self.state)
@@ -4,6 +4,7 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     agents_file: str = "data/agents.json"
     areas_file: str = "data/areas_v2.json"
+    cache_dir: str | None = None
 
     OPENAI_API_KEY: str | None = None
     GEMINI_API_KEY: str | None = None
@@ -0,0 +1,88 @@
+from __future__ import annotations
+import hashlib
+import re
+import unicodedata
+from typing import Generic, TypeVar
+
+from pydantic import BaseModel, PrivateAttr
+
+
+T = TypeVar("T")
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r"[\s\W_]+", "", text)
+
+
+def shingles(text: str, n: int = 3) -> set[str]:
+    text = normalize(text)
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _hash(value: str, seed: int = 0) -> int:
+    digest = hashlib.blake2b(value.encode(), digest_size=8, salt=seed.to_bytes(8, "little")).digest()
+    return int.from_bytes(digest, "little")
+
+
+class MinHash(BaseModel):
+    num_perm: int = 64
+    ngram: int = 3
+    _perms: list[tuple[int, int]] = PrivateAttr()
+
+    def model_post_init(self, context) -> None:
+        self._perms = [
+            (_hash(str(i), 1) % (_PRIME - 1) + 1, _hash(str(i), 2) % _PRIME)
+            for i in range(self.num_perm)
+        ]
+
+    def signature(self, text: str) -> tuple[int, ...]:
+        hashes = [_hash(s) for s in shingles(text, self.ngram)]
+        return tuple(min(((a * h + b) % _PRIME) & _MASK for h in hashes) for a, b in self._perms)
+
+    @staticmethod
+    def similarity(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+        return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class SimilarityIndex(BaseModel, Generic[T]):
+    threshold: float = 0.8
+    num_perm: int = 64
+    bands: int = 16
+    ngram: int = 3
+    _minhash: MinHash = PrivateAttr()
+    _entries: list[tuple[tuple[int, ...], T]] = PrivateAttr(default_factory=list)
+    _buckets: dict[tuple[int, tuple[int, ...]], list[int]] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, context) -> None:
+        if self.num_perm % self.bands:
+            raise ValueError(f"`bands`: {self.bands}")
+        self._minhash = MinHash(num_perm=self.num_perm, ngram=self.ngram)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, signature: tuple[int, ...]) -> list[tuple[int, tuple[int, ...]]]:
+        rows = self.num_perm // self.bands
+        return [(i, signature[i * rows:(i + 1) * rows]) for i in range(self.bands)]
+
+    def add(self, text: str, value: T) -> None:
+        signature = self._minhash.signature(text)
+        self._entries.append((signature, value))
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(len(self._entries) - 1)
+
+    def query(self, text: str) -> tuple[float, T] | None:
+        signature = self._minhash.signature(text)
+        candidates = {i for key in self._band_keys(signature) for i in self._buckets.get(key, [])}
+        best = None
+        for i in candidates:
+            score = MinHash.similarity(signature, self._entries[i][0])
+            if score >= self.threshold and (best is None or score > best[0]):
+                best = (score, self._entries[i][1])
+        return best
@@ -13,7 +13,14 @@ class Clock(BaseModel):
     
     @property
     def now(self) -> str:
-        day, hour, minute = evaluate(self._clock)
+        return self.at()
+
+    @property
+    def tick(self) -> int:
+        return self._clock
+
+    def at(self, offset: int=0) -> str:
+        day, hour, minute = evaluate(self._clock + offset)
         return f"{day + 1}日目 {str(hour).zfill(2)}時{str(minute).zfill(2)}分"
     
     @override
@@ -47,8 +54,17 @@ def calc(*, day: int=0, hour: int=0, minute: int=0) -> int:
 
 
 def parse(text: str) -> int:
-    pattern = r"P(Y(?P<day>\d+))?(H(?P<hour>\d+))?(M(?P<minute>\d+))?"
-    return calc(**re.search(pattern, text).groupdict())
+    pattern = r"P(?:(?P<day>\d+)D)?(?:T(?:(?P<hour>\d+)H)?(?:(?P<minute>\d+)M)?)?"
+    match = re.fullmatch(pattern, text.strip().upper())
+    if match is None or not any(match.groups()):
+        raise ValueError(f"`text`: {text}")
+    day, hour, minute = (int(value or 0) for value in match.groups())
+    minutes = (day * 24 + hour) * 60 + minute
+    if minutes == 0:
+        raise ValueError(f"`text`: {text}")
+    # anything shorter than a tick still takes one, so the action timer cannot start at 0
+    minutes = max(minutes, 10)
+    return calc(day=minutes // (24 * 60), hour=minutes // 60 % 24, minute=minutes % 60)
 
 
 def evaluate(clock: int) -> tuple[int, int, int]:
@@ -0,0 +1,76 @@
+from __future__ import annotations
+import json
+import os
+import time
+from typing import Any
+
+from pydantic import BaseModel, PrivateAttr
+
+from .hooks import EVENTS, Event, Hooks
+
+
+class ChromeTracer(BaseModel):
+    pid: int = 1
+    _origin: float = PrivateAttr(default_factory=time.perf_counter)
+    _events: list[dict[str, Any]] = PrivateAttr(default_factory=list)
+    _threads: dict[str, int] = PrivateAttr(default_factory=lambda: {"society": 0})
+
+    def attach(self, hooks: Hooks) -> ChromeTracer:
+        for name in EVENTS:
+            hooks.on(name, self.handle)
+        return self
+
+    def detach(self, hooks: Hooks) -> None:
+        for name in EVENTS:
+            hooks.off(name, self.handle)
+
+    def _tid(self, thread: str) -> int:
+        if thread not in self._threads:
+            self._threads[thread] = len(self._threads)
+        return self._threads[thread]
+
+    def _us(self, seconds: float) -> float:
+        return (seconds - self._origin) * 1_000_000
+
+    def handle(self, event: Event) -> None:
+        if event.name == "on_tick_start":
+            return
+        if "agent" in event.data:
+            thread = event.data["agent"].id
+        elif "area" in event.data:
+            thread = event.data["area"].id
+        else:
+            thread = "society"
+        name = {
+            "on_agent_decided": "decide",
+            "on_action_evaluated": "evaluate",
+            "on_logs_dispatched": "dispatch_logs",
+            "on_area_updated": "update_area",
+            "on_tick_end": "tick",
+        }[event.name]
+        args = {"tick": event.tick}
+        if (action := event.data.get("action")) is not None:
+            args["action"] = type(action).__name__
+        self._events.append({
+            "name": name,
+            "cat": event.name,
+            "ph": "X",
+            "ts": self._us(event.start),
+            "dur": (event.end - event.start) * 1_000_000,
+            "pid": self.pid,
+            "tid": self._tid(thread),
+            "args": args,
+        })
+
+    def dump(self) -> dict[str, Any]:
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": thread}}
+            for thread, tid in self._threads.items()
+        ]
+        return {"traceEvents": metadata + self._events, "displayTimeUnit": "ms"}
+
+    def write(self, filepath: str) -> None:
+        tmp = f"{filepath}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.dump(), f, ensure_ascii=False)
+        os.replace(tmp, filepath)